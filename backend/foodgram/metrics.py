@@ -0,0 +1,324 @@
+"""
+Метрики в текстовом формате Prometheus: /api/metrics.
+
+Каждый процесс копит значения в своём словаре под блокировкой
+(+= над словарём не атомарно, а воркер может быть многопоточным)
+и раз в METRICS_FLUSH_INTERVAL секунд из фонового потока
+сбрасывает их в METRICS_DIR/<pid>-<id>.json. Эндпоинт суммирует
+файлы всех процессов, так что при нескольких воркерах gunicorn
+счётчики общие. Файлы завершившихся воркеров эндпоинт переносит
+в один METRICS_DIR/merged.json и удаляет: счётчики не уменьшаются
+при перезапуске воркеров, а число файлов не растёт.
+
+Собираются: число и длительность запросов по маршрутам (имя URL,
+метод, статус), число SQL-запросов на запрос, попадания в кэши
+и размеры загружаемых фото.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .profiling import is_admin
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Сумма значений завершившихся процессов.
+MERGED = 'merged.json'
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+IMAGE_BUCKETS = tuple(
+    int(size * 1024 * 1024) for size in (0.0625, 0.25, 0.5, 1, 2, 5, 10, 20)
+)
+
+# Семейство: (тип, описание).
+FAMILIES = {
+    'foodgram_http_requests_total': (
+        'counter', 'HTTP requests by route, method and status.'),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'HTTP request duration by route and method.'),
+    'foodgram_db_queries_per_request': (
+        'histogram', 'SQL queries per HTTP request by route.'),
+    'foodgram_cache_requests_total': (
+        'counter', 'Cache lookups by cache and result (hit or miss).'),
+    'foodgram_image_upload_bytes': (
+        'histogram', 'Size of uploaded recipe photos.'),
+}
+
+
+class Registry:
+    """Значения метрик одного процесса."""
+
+    def __init__(self):
+        self.pid = None
+        self.path = None
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def reset_lock(self):
+        """Блокировка, захваченная в родителе при fork, в потомке новая."""
+        self.lock = threading.Lock()
+
+    def check_process(self):
+        """После fork воркер начинает с нуля и со своим файлом."""
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.values = defaultdict(float)
+            self.path = os.path.join(
+                settings.METRICS_DIR, f'{os.getpid()}-{uuid4().hex[:8]}.json')
+            self.pid = os.getpid()
+        thread = threading.Thread(target=self.flush_periodically)
+        thread.daemon = True
+        thread.start()
+
+    def inc(self, name, labels=(), value=1):
+        self.check_process()
+        with self.lock:
+            self.values[name, labels] += value
+
+    def observe(self, name, buckets, value, labels=()):
+        """Наблюдение гистограммы: кумулятивные корзины, сумма и число."""
+        for bound in buckets:
+            # Пустые корзины тоже выводятся, с нулём.
+            self.inc(
+                f'{name}_bucket', labels + (('le', str(bound)),),
+                int(value <= bound),
+            )
+        self.inc(f'{name}_bucket', labels + (('le', '+Inf'),))
+        self.inc(f'{name}_sum', labels, value)
+        self.inc(f'{name}_count', labels)
+
+    def flush(self):
+        self.check_process()
+        with self.lock:
+            values = self.values.copy()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_samples(self.path, values)
+
+    def flush_periodically(self):
+        pid = self.pid
+        while pid == os.getpid():
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+
+registry = Registry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.reset_lock)
+
+
+def inc(name, labels=(), value=1):
+    registry.inc(name, tuple(labels), value)
+
+
+def observe(name, buckets, value, labels=()):
+    registry.observe(name, buckets, value, tuple(labels))
+
+
+def cache_lookup(name, hit):
+    inc('foodgram_cache_requests_total',
+        (('cache', name), ('result', 'hit' if hit else 'miss')))
+
+
+def write_samples(path, values):
+    # Поток сброса и эндпоинт могут писать одновременно.
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump([
+            [name, list(labels), value]
+            for (name, labels), value in values.items()
+        ], file)
+    os.replace(temporary, path)
+
+
+def read_samples(path, totals):
+    """Прибавляет значения из файла к totals."""
+    try:
+        with open(path) as file:
+            samples = json.load(file)
+    except (OSError, ValueError):
+        return
+    for name, labels, value in samples:
+        totals[name, tuple(map(tuple, labels))] += value
+
+
+def process_exited(filename):
+    """Процесс, записавший файл <pid>-..., завершился."""
+    pid, _, _ = filename.partition('-')
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+@contextmanager
+def exclusive(directory):
+    """
+    Блокировка каталога метрик между процессами; без fcntl - False.
+    """
+    if fcntl is None:
+        yield False
+        return
+    with open(os.path.join(directory, '.lock'), 'w') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield True
+
+
+def merge(directory, paths):
+    """Переносит значения из paths в MERGED и удаляет эти файлы."""
+    merged = defaultdict(float)
+    for path in (os.path.join(directory, MERGED), *paths):
+        if path.endswith('.json'):
+            read_samples(path, merged)
+    write_samples(os.path.join(directory, MERGED), merged)
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect():
+    """Сумма значений всех процессов: {(имя, метки): значение}."""
+    registry.flush()
+    directory = settings.METRICS_DIR
+    totals = defaultdict(float)
+    # Под блокировкой никто не видит файл завершившегося процесса
+    # одновременно с уже перенесёнными в MERGED значениями.
+    with exclusive(directory) as locked:
+        exited = []
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if filename.endswith('.json'):
+                read_samples(path, totals)
+            if locked and process_exited(filename):
+                exited.append(path)
+        if exited:
+            merge(directory, exited)
+    return totals
+
+
+def family_of(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+
+def sample_key(item):
+    (name, labels), _ = item
+    labels = dict(labels)
+    bound = labels.pop('le', None)
+    return (
+        name, sorted(labels.items()),
+        float(bound) if bound is not None else 0,
+    )
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'),
+        )
+        for name, value in labels
+    )
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render(totals):
+    samples = defaultdict(list)
+    for item in sorted(totals.items(), key=sample_key):
+        samples[family_of(item[0][0])].append(item)
+    lines = []
+    for family, (metric_type, description) in FAMILIES.items():
+        lines.append(f'# HELP {family} {description}')
+        lines.append(f'# TYPE {family} {metric_type}')
+        for (name, labels), value in samples[family]:
+            lines.append(
+                f'{name}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Метрики всех процессов.
+
+    С METRICS_TOKEN нужен заголовок Authorization: Bearer <токен>,
+    без него эндпоинт доступен только администраторам.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = request.META.get('HTTP_AUTHORIZATION') == f'Bearer {token}'
+    else:
+        allowed = is_admin(request)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    Число, длительность и SQL-запросы запросов по маршрутам.
+
+    Стоит первым в MIDDLEWARE, перед ServerTimingMiddleware, так что
+    длительность включает все middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        route = match.view_name if match is not None else 'unmatched'
+        inc('foodgram_http_requests_total', (
+            ('route', route), ('method', request.method),
+            ('status', response.status_code),
+        ))
+        observe(
+            'foodgram_http_request_duration_seconds', DURATION_BUCKETS,
+            duration, (('route', route), ('method', request.method)),
+        )
+        observe(
+            'foodgram_db_queries_per_request', QUERIES_BUCKETS, queries[0],
+            (('route', route),),
+        )
+        return response
@@ -0,0 +1,169 @@
+"""
+Профилирование отдельных запросов через cProfile и tracemalloc.
+
+Запрос профилируется, если администратор прислал заголовок
+X-Profile (значение memory включает и tracemalloc), или по выборке
+PROFILING_SAMPLE_RATES по имени URL. В PROFILING_DIR пишутся
+<имя>.prof (для pstats/snakeviz), <имя>.json с описанием запроса
+и при замере памяти <имя>.mem.txt с крупнейшими выделениями; хранятся
+последние PROFILING_MAX_PROFILES профилей. Потоковые ответы
+профилируются до конца отдачи. Посмотреть профили: manage.py profiles.
+"""
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from uuid import uuid4
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .timing import get_url_name, is_sampled
+
+HEADER = 'HTTP_X_PROFILE'
+MEMORY = 'memory'
+SUFFIXES = ('.prof', '.json', '.mem.txt')
+END = object()
+
+
+def is_admin(request):
+    """Администратор по сессии или по токену API."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        try:
+            user, _ = TokenAuthentication().authenticate(request) or (
+                None, None)
+        except AuthenticationFailed:
+            return False
+    return user is not None and user.is_admin
+
+
+def profile_names(directory):
+    """Имена сохранённых профилей, от старых к новым."""
+    try:
+        files = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        name[:-len('.json')] for name in files if name.endswith('.json'))
+
+
+def rotate(directory, keep):
+    for name in profile_names(directory)[:-keep or None]:
+        for suffix in SUFFIXES:
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+class Capture:
+    """cProfile и, по желанию, tracemalloc одного запроса."""
+
+    def __init__(self, request, url_name, memory):
+        self.request = request
+        self.url_name = url_name
+        self.name = (
+            f'{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}-'
+            f'{uuid4().hex[:6]}-'
+            f'{request.method.lower()}-'
+            f'{(url_name or "unknown").replace(":", ".")}'
+        )
+        self.profiler = cProfile.Profile()
+        # tracemalloc общий для процесса: второй запрос его не включает.
+        self.memory = memory and not tracemalloc.is_tracing()
+        self.elapsed = 0
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(settings.PROFILING_MEMORY_FRAMES)
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.elapsed += time.perf_counter() - self.started
+
+    def stream(self, content, response):
+        """Отдаёт части потокового ответа, профилируя их получение."""
+        iterator = iter(content)
+        try:
+            while True:
+                with self:
+                    chunk = next(iterator, END)
+                if chunk is END:
+                    break
+                yield chunk
+        finally:
+            self.save(response)
+
+    def save(self, response):
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+        # Снимок памяти до записи профиля, которая тоже выделяет память.
+        if self.memory:
+            self.save_memory(path + '.mem.txt')
+        self.profiler.dump_stats(path + '.prof')
+        with open(path + '.json', 'w') as file:
+            json.dump({
+                'method': self.request.method,
+                'path': self.request.get_full_path(),
+                'url_name': self.url_name,
+                'status': response.status_code,
+                'duration_ms': round(self.elapsed * 1000, 1),
+                'memory': self.memory,
+            }, file)
+        rotate(directory, settings.PROFILING_MAX_PROFILES)
+
+    def save_memory(self, path):
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(path, 'w') as file:
+            file.write(f'Current: {current} B, peak: {peak} B\n\n')
+            for statistic in snapshot.statistics('lineno')[
+                    :settings.PROFILING_MEMORY_TOP]:
+                file.write(f'{statistic}\n')
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует запрос, см. модуль.
+
+    Стоит после AuthenticationMiddleware; пользователь API
+    определяется по токену, только если пришёл заголовок X-Profile.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rates = settings.PROFILING_SAMPLE_RATES
+
+    def __call__(self, request):
+        url_name = get_url_name(request)
+        header = request.META.get(HEADER)
+        requested = header is not None and is_admin(request)
+        if requested:
+            memory = header == MEMORY
+        elif is_sampled(self.rates, url_name):
+            memory = settings.PROFILING_MEMORY
+        else:
+            return self.get_response(request)
+        capture = Capture(request, url_name, memory)
+        with capture:
+            response = self.get_response(request)
+        if requested:
+            response['X-Profile-Id'] = capture.name
+        if response.streaming:
+            response.streaming_content = capture.stream(
+                response.streaming_content, response)
+        else:
+            capture.save(response)
+        return response
@@ -9,7 +9,9 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import json
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -49,11 +51,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
+    'foodgram.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'foodgram.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,6 +102,102 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    },
+    # Поколения кэшей (см. recipe.cache.get_version) должны быть общими
+    # для всех воркеров и management-команд: по ним процессы узнают
+    # о сбросе кэша и перестраивают свои снимки и индексы. Файлы
+    # годятся для одного хоста, для нескольких - Redis или memcached.
+    'versions': {
+        'BACKEND': os.getenv(
+            'VERSIONS_CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'VERSIONS_CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram-versions')
+        ),
+    },
+}
+
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', default=300))
+
+# Как часто индекс автодополнения ингредиентов пересчитывает популярность.
+RECIPE_INGREDIENTS_INDEX_TTL = int(
+    os.getenv('RECIPE_INGREDIENTS_INDEX_TTL', default=600)
+)
+
+# Готовые файлы списка покупок, см. recipe.shopping_list.
+SHOPPING_LIST_CACHE_TIMEOUT = int(
+    os.getenv('SHOPPING_LIST_CACHE_TIMEOUT', default=24 * 60 * 60)
+)
+# TrueType-шрифт с кириллицей для PDF.
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Доля запросов с замером времени (заголовок Server-Timing и журнал
+# foodgram.timing) по имени URL, '*' - для остальных.
+# Например: {"recipes:recipes-list": 0.1, "*": 0.01}.
+SERVER_TIMING_SAMPLE_RATES = json.loads(
+    os.getenv('SERVER_TIMING_SAMPLE_RATES', default='{"*": 0.01}')
+)
+
+# Профили запросов, см. foodgram.profiling. Администратор включает
+# профилирование заголовком X-Profile, остальные запросы - по выборке
+# как у SERVER_TIMING_SAMPLE_RATES.
+PROFILING_SAMPLE_RATES = json.loads(
+    os.getenv('PROFILING_SAMPLE_RATES', default='{}')
+)
+# Замер памяти через tracemalloc для запросов из выборки.
+PROFILING_MEMORY = os.getenv('PROFILING_MEMORY', default='') == 'True'
+PROFILING_MEMORY_FRAMES = 10
+PROFILING_MEMORY_TOP = 25
+PROFILING_DIR = os.getenv(
+    'PROFILING_DIR', default=os.path.join(BASE_DIR, 'profiles')
+)
+PROFILING_MAX_PROFILES = int(
+    os.getenv('PROFILING_MAX_PROFILES', default=100)
+)
+
+# Метрики Prometheus на /api/metrics, см. foodgram.metrics. Каталог
+# должен быть общим для всех воркеров gunicorn.
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'foodgram-metrics')
+)
+METRICS_FLUSH_INTERVAL = float(
+    os.getenv('METRICS_FLUSH_INTERVAL', default=5)
+)
+# Токен для Authorization: Bearer; без него - только администраторы.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram.timing': {
+            'handlers': ['console'],
+            'level': os.getenv('SERVER_TIMING_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -139,6 +240,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Ограничения на загружаемые фото рецептов.
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.getenv('RECIPE_IMAGE_MAX_PIXELS', default=40_000_000)
+)
+# base64 увеличивает размер в 4/3 раза, плюс запас на остальные поля.
+# Предел тела JSON в BoundedJSONParser; client_max_body_size в
+# infra/nginx.conf должен быть не меньше.
+RECIPE_JSON_MAX_SIZE = RECIPE_IMAGE_MAX_SIZE * 4 // 3 + 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,198 @@
+"""
+Замер времени обработки запроса: SQL, view, аутентификация и права,
+сериализатор, обработка фото и рендеринг.
+
+ServerTimingMiddleware замеряет долю запросов, заданную
+для имени URL в SERVER_TIMING_SAMPLE_RATES, и отдаёт результат
+заголовком Server-Timing и строкой JSON в логгер foodgram.timing.
+Участки кода отмечаются через measure(name); вне замеряемого
+запроса он ничего не делает. Метрики пересекаются: view включает
+serializer, permissions и часть db. Запросы к БД при отдаче потокового
+ответа (после выхода из middleware) не учитываются.
+"""
+import json
+import logging
+import random
+import threading
+from collections import defaultdict
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Порядок метрик в заголовке и журнале.
+METRICS = (
+    'db', 'view', 'auth', 'permissions', 'serializer', 'image', 'render',
+)
+
+
+class Timer:
+    """Накопленное время участков одного запроса."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.durations = defaultdict(float)
+        self.running = {}
+        self.queries = 0
+
+    def start(self, name):
+        self.running.setdefault(name, perf_counter())
+
+    def stop(self, name):
+        started = self.running.pop(name, None)
+        if started is not None:
+            self.durations[name] += perf_counter() - started
+
+    def execute(self, execute, sql, params, many, context):
+        """Обёртка для connection.execute_wrapper."""
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += perf_counter() - started
+            self.queries += 1
+
+    def metrics(self):
+        """{метрика: миллисекунды}, total - всё время запроса."""
+        for name in list(self.running):
+            self.stop(name)
+        metrics = {'total': (perf_counter() - self.started) * 1000}
+        metrics.update(
+            (name, self.durations[name] * 1000)
+            for name in METRICS if name in self.durations
+        )
+        return metrics
+
+
+def current():
+    """Timer текущего запроса или None, если он не замеряется."""
+    return getattr(_local, 'timer', None)
+
+
+class measure:
+    """
+    Контекстный менеджер, прибавляющий время блока к метрике name.
+
+    Вложенные блоки с тем же именем не считаются дважды.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.timer = current()
+        self.outer = self.timer is not None and name not in self.timer.running
+
+    def __enter__(self):
+        if self.outer:
+            self.timer.start(self.name)
+
+    def __exit__(self, *exc_info):
+        if self.outer:
+            self.timer.stop(self.name)
+
+
+class TimedSerializerMixin:
+    """Время to_representation попадает в метрику serializer."""
+
+    def to_representation(self, instance):
+        if current() is None:
+            return super().to_representation(instance)
+        with measure('serializer'):
+            return super().to_representation(instance)
+
+
+class TimedViewMixin:
+    """Аутентификация и проверка прав попадают в свои метрики."""
+
+    def perform_authentication(self, request):
+        with measure('auth'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with measure('permissions'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with measure('permissions'):
+            super().check_object_permissions(request, obj)
+
+
+def get_url_name(request):
+    try:
+        return resolve(request.path_info).view_name
+    except Resolver404:
+        return None
+
+
+def is_sampled(rates, url_name):
+    """Попал ли запрос в выборку по {имя URL или '*': доля}."""
+    rate = rates.get(url_name, rates.get('*', 0))
+    return bool(rate) and random.random() < rate
+
+
+def server_timing(metrics, queries):
+    parts = []
+    for name, duration in metrics.items():
+        part = f'{name};dur={duration:.1f}'
+        if name == 'db':
+            part += f';desc="{queries} queries"'
+        parts.append(part)
+    return ', '.join(parts)
+
+
+class ServerTimingMiddleware:
+    """
+    Замеряет выборку запросов, см. модуль.
+
+    Стоит в MIDDLEWARE сразу после MetricsMiddleware: total включает
+    все остальные middleware, но не сбор метрик, который измеряет
+    и этот middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rates = settings.SERVER_TIMING_SAMPLE_RATES
+
+    def __call__(self, request):
+        url_name = get_url_name(request)
+        if not is_sampled(self.rates, url_name):
+            return self.get_response(request)
+        timer = _local.timer = Timer()
+        try:
+            with connection.execute_wrapper(timer.execute):
+                response = self.get_response(request)
+        finally:
+            _local.timer = None
+        metrics = timer.metrics()
+        response['Server-Timing'] = server_timing(metrics, timer.queries)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'url_name': url_name,
+            'status': response.status_code,
+            'queries': timer.queries,
+            **{
+                f'{name}_ms': round(duration, 1)
+                for name, duration in metrics.items()
+            },
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timer = current()
+        if timer is not None:
+            timer.start('view')
+
+    def process_template_response(self, request, response):
+        """Ответы DRF рендерятся после view, время рендера - отдельно."""
+        timer = current()
+        if timer is not None:
+            timer.stop('view')
+            timer.start('render')
+            response.add_post_render_callback(
+                lambda response: timer.stop('render'))
+        return response
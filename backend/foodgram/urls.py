@@ -19,8 +19,11 @@ from django.conf import settings
 from django.conf.urls.static import static
 
 
+from foodgram.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/metrics', metrics_view, name='metrics'),
     path('api/', include('users.urls', namespace='users')),
     path('api/', include('recipe.urls', namespace='recipes')),
 ]
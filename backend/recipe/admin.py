@@ -1,5 +1,9 @@
 from django.contrib import admin
+from django.db.models import Count
+from . import cart_totals, search
 from .forms import TagForm
+from .images import save_variants
+from .signals import bump_cache_version, touch_recipes
 from .models import (FavoriteRecipe, Ingredients, Recipe, IngredientsInRecipe,
                      ShoppingList, Tags)
 
@@ -28,8 +32,14 @@ class IngredientAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     ordering = ('measurement_unit',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_count=Count('recipe_ingredients')
+        )
+
+    @admin.display(description='Рецептов', ordering='recipes_count')
     def get_recipes_count(self, obj):
-        return IngredientsInRecipe.objects.filter(ingredient=obj.id).count()
+        return obj.recipes_count
 
 
 class RecipeIngredientsInline(admin.TabularInline):
@@ -55,10 +65,31 @@ class RecipeAdmin(admin.ModelAdmin):
         'id',
         'name',
         'author',
+        'favorites_count',
     )
     list_filter = ('name', 'author',)
     inlines = (RecipeIngredientsInline,)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            save_variants(obj)
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Переносит изменения ингредиентов в списки покупок и отмечает
+        рецепт изменённым один раз на всё сохранение.
+        """
+        before = cart_totals.recipe_amounts(form.instance.pk)
+        super().save_related(request, form, formsets, change)
+        cart_totals.change_recipe(form.instance.pk, cart_totals.amounts_delta(
+            before, cart_totals.recipe_amounts(form.instance.pk)
+        ))
+        if any(formset.has_changed() for formset in formsets):
+            touch_recipes(pk=form.instance.pk)
+            bump_cache_version()
+            search.schedule_update([form.instance.pk])
+
 
 @admin.register(FavoriteRecipe)
 class FavoriteRecipeAdmin(admin.ModelAdmin):
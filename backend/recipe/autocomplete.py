@@ -0,0 +1,174 @@
+"""
+Индекс ингредиентов для автодополнения в памяти процесса.
+
+Отсортированный массив ключей (название целиком и с начала каждого
+слова) отвечает на префиксные запросы бинарным поиском, индекс
+триграмм с расстоянием Левенштейна - на запросы с опечатками.
+Результаты упорядочены по числу рецептов с ингредиентом.
+Индекс перестраивается при смене поколения ингредиентов в кэше
+(см. recipe.signals) и не реже RECIPE_INGREDIENTS_INDEX_TTL секунд.
+"""
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models import Count
+
+from . import cache
+from .models import Ingredients
+
+WORD_START = re.compile(r'(?:^|\W)(?=\w)')
+# Опечатки ищутся в начале названия такой длины.
+FUZZY_PREFIX = 16
+# Сколько кандидатов по триграммам проверяется расстоянием Левенштейна.
+FUZZY_CANDIDATES = 20
+
+
+def normalize(value):
+    """Регистр и ё/е не различаются."""
+    return value.casefold().replace('ё', 'е').strip()
+
+
+def trigrams(value):
+    value = f'  {value} '
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def prefix_distance(query, name, limit):
+    """
+    Наименьшее расстояние Левенштейна между query и началом name.
+
+    Обрывается, как только оно заведомо больше limit.
+    """
+    name = name[:len(query) + limit]
+    previous = list(range(len(name) + 1))
+    for i, query_char in enumerate(query, 1):
+        current = [i]
+        for j, name_char in enumerate(name, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (query_char != name_char),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[max(0, len(query) - limit):])
+
+
+class IngredientIndex:
+    """Неизменяемый индекс по списку (id, name, measurement_unit, uses)."""
+
+    def __init__(self, rows):
+        self.items = [
+            {'id': id, 'name': name, 'measurement_unit': unit}
+            for id, name, unit, _ in rows
+        ]
+        self.uses = [uses for *_, uses in rows]
+        self.names = [normalize(name) for _, name, _, _ in rows]
+        keys = []
+        self.trigrams = defaultdict(list)
+        for position, name in enumerate(self.names):
+            for match in WORD_START.finditer(name):
+                keys.append((name[match.end():], match.end() > 0, position))
+            for trigram in trigrams(name[:FUZZY_PREFIX]):
+                self.trigrams[trigram].append(position)
+        keys.sort()
+        self.keys = [key for key, _, _ in keys]
+        self.positions = [(inner, position) for _, inner, position in keys]
+
+    def rank(self, position, query=None):
+        name = self.names[position]
+        return name != query, -self.uses[position], name
+
+    def prefix(self, query, limit=None):
+        """Позиции ингредиентов, у которых слово начинается с query."""
+        start = bisect_left(self.keys, query)
+        stop = bisect_left(self.keys, query + '\uffff', start)
+        best = {}
+        for inner, position in self.positions[start:stop]:
+            best[position] = min(best.get(position, True), inner)
+        # Совпадение с начала названия важнее совпадения с начала слова.
+        ordered = sorted(best, key=lambda position: (
+            best[position], self.rank(position, query)
+        ))
+        return ordered[:limit] if limit else ordered
+
+    def fuzzy(self, query, limit=None, exclude=()):
+        """Позиции ингредиентов с опечаткой в начале названия."""
+        query = query[:FUZZY_PREFIX]
+        query_trigrams = trigrams(query)
+        counter = Counter()
+        for trigram in query_trigrams:
+            counter.update(self.trigrams.get(trigram, ()))
+        max_distance = max(1, len(query) // 4)
+        # Каждая правка портит не больше трёх триграмм запроса.
+        min_shared = len(query_trigrams) - 3 * max_distance - 1
+        found = []
+        for position, shared in counter.most_common(FUZZY_CANDIDATES):
+            if shared < min_shared:
+                break
+            if position in exclude:
+                continue
+            distance = prefix_distance(
+                query, self.names[position], max_distance)
+            if distance <= max_distance:
+                found.append((distance, self.rank(position), position))
+        found = (heapq.nsmallest(limit, found) if limit else sorted(found))
+        return [position for *_, position in found]
+
+    def search(self, query, limit=None):
+        query = normalize(query)
+        if not query:
+            return []
+        positions = self.prefix(query, limit)
+        # Без limit опечатки ищутся, только если точных совпадений нет.
+        need_fuzzy = (
+            not positions if limit is None else len(positions) < limit
+        )
+        if len(query) >= 3 and need_fuzzy:
+            positions += self.fuzzy(
+                query,
+                limit and limit - len(positions),
+                exclude=set(positions),
+            )
+        return [self.items[position] for position in positions]
+
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+_index_built = 0
+
+
+def build_index():
+    rows = Ingredients.objects.annotate(
+        uses=Count('recipe_ingredients')
+    ).values_list('id', 'name', 'measurement_unit', 'uses').order_by()
+    return IngredientIndex(list(rows))
+
+
+def _is_stale(version):
+    return (
+        _index is None
+        or version != _index_version
+        or time.monotonic() - _index_built
+        > settings.RECIPE_INGREDIENTS_INDEX_TTL
+    )
+
+
+def get_index():
+    """Индекс текущего процесса, перестроенный при необходимости."""
+    global _index, _index_version, _index_built
+    version = cache.get_version(cache.INGREDIENTS_VERSION_KEY)
+    if _is_stale(version):
+        with _lock:
+            if _is_stale(version):
+                _index = build_index()
+                _index_version = version
+                _index_built = time.monotonic()
+    return _index
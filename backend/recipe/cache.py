@@ -0,0 +1,122 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from rest_framework import status
+from rest_framework.response import Response
+
+from foodgram import metrics
+from users.subscriptions import subscribed_author_ids
+from .models import FavoriteRecipe, Recipe, ShoppingList
+
+VERSION_KEY = 'recipes:version'
+INGREDIENTS_VERSION_KEY = 'ingredients:version'
+TAGS_VERSION_KEY = 'tags:version'
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart')
+# Счётчики меняются без сброса кэша и подставляются при каждом запросе.
+COUNTERS = ('favorites_count',)
+
+
+def get_version(key=VERSION_KEY):
+    """
+    Текущее поколение кэша (по умолчанию - рецептов).
+
+    Поколения хранятся в общем для процессов кэше versions, см.
+    CACHES в настройках.
+    """
+    versions = caches['versions']
+    version = versions.get(key)
+    if version is None:
+        versions.add(key, time.time_ns(), None)
+        version = versions.get(key)
+    return version
+
+
+def bump_version(key=VERSION_KEY):
+    """
+    Делает устаревшим всё, что построено на прежнем поколении.
+
+    Новое значение - время, а не incr(): у файлового кэша incr
+    не атомарен, и два процесса могли бы записать одно поколение.
+    """
+    caches['versions'].set(key, time.time_ns(), None)
+
+
+def is_cacheable(request):
+    """Ответ не зависит от пользователя, кроме флагов рецепта."""
+    return not any(flag in request.query_params for flag in USER_FLAGS)
+
+
+def make_key(request, action):
+    query = request.query_params
+    params = sorted(
+        (name, value) for name in query for value in query.getlist(name)
+    )
+    url = request.build_absolute_uri(request.path) + repr(params)
+    digest = md5(url.encode()).hexdigest()
+    return f'recipes:{get_version()}:{action}:{digest}'
+
+
+def get_recipes(data):
+    return data['results'] if 'results' in data else [data]
+
+
+def apply_counters(data):
+    """Проставляет актуальные значения COUNTERS."""
+    recipes = get_recipes(data)
+    counters = {
+        id: values for id, *values in Recipe.objects.filter(
+            id__in=[recipe['id'] for recipe in recipes]
+        ).values_list('id', *COUNTERS)
+    }
+    for recipe in recipes:
+        if recipe['id'] in counters:
+            recipe.update(zip(COUNTERS, counters[recipe['id']]))
+    return data
+
+
+def apply_user_flags(data, request):
+    """
+    Проставляет is_favorited / is_in_shopping_cart и is_subscribed
+    автора для пользователя запроса.
+    """
+    user = request.user
+    recipes = get_recipes(data)
+    subscribed = subscribed_author_ids(request)
+    favorited = in_shopping_cart = set()
+    if user.is_authenticated:
+        ids = [recipe['id'] for recipe in recipes]
+        favorited = set(FavoriteRecipe.objects.filter(
+            user=user, recipe__in=ids
+        ).values_list('recipe_id', flat=True))
+        in_shopping_cart = set(ShoppingList.objects.filter(
+            user=user, recipe__in=ids
+        ).values_list('recipe_id', flat=True))
+    for recipe in recipes:
+        recipe['is_favorited'] = recipe['id'] in favorited
+        recipe['is_in_shopping_cart'] = recipe['id'] in in_shopping_cart
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in subscribed
+        )
+    return data
+
+
+def cached_response(request, action, get_response):
+    """
+    Отдаёт ответ из кэша или строит его через get_response.
+
+    В кэш попадают только успешные ответы, флаги пользователя
+    и счётчики подставляются при каждом запросе.
+    """
+    if not is_cacheable(request):
+        return get_response()
+    key = make_key(request, action)
+    data = cache.get(key)
+    metrics.cache_lookup('recipes', data is not None)
+    if data is not None:
+        return Response(apply_user_flags(apply_counters(data), request))
+    response = get_response()
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(key, response.data, settings.RECIPES_CACHE_TIMEOUT)
+    return response
@@ -0,0 +1,114 @@
+"""
+Суммы ингредиентов в списках покупок пользователей.
+
+Таблица IngredientsInShoppingList меняется приращениями: при
+добавлении и удалении рецепта из списка покупок (recipe.signals) и
+при изменении ингредиентов рецепта, который лежит в чьих-то списках.
+Пакетные операции с IngredientsInRecipe сигналов не отправляют,
+поэтому код, который их выполняет, вызывает change_recipe() сам.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+
+from .models import (IngredientsInRecipe,
+                     IngredientsInShoppingList,
+                     ShoppingList)
+
+
+def recipe_amounts(recipe_id):
+    """Ингредиенты рецепта: {ingredient_id: amount}."""
+    return dict(IngredientsInRecipe.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', 'amount'))
+
+
+def amounts_delta(before, after):
+    """Разница двух словарей {ingredient_id: amount}."""
+    delta = defaultdict(int)
+    for ingredient_id, amount in after.items():
+        delta[ingredient_id] += amount
+    for ingredient_id, amount in before.items():
+        delta[ingredient_id] -= amount
+    return {
+        ingredient_id: amount for ingredient_id, amount in delta.items()
+        if amount
+    }
+
+
+def change_totals(user_ids, delta, sign=1):
+    """
+    Прибавляет sign * delta к суммам пользователей user_ids.
+
+    Три запроса при любом числе пользователей и ингредиентов:
+    недостающие строки, одно UPDATE с CASE и удаление обнулившихся.
+    """
+    user_ids = list(user_ids)
+    delta = {
+        ingredient_id: sign * amount
+        for ingredient_id, amount in delta.items() if amount
+    }
+    if not user_ids or not delta:
+        return
+    with transaction.atomic():
+        IngredientsInShoppingList.objects.bulk_create(
+            (
+                IngredientsInShoppingList(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=0
+                )
+                for user_id in user_ids for ingredient_id in delta
+            ),
+            ignore_conflicts=True,
+        )
+        totals = IngredientsInShoppingList.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=delta
+        )
+        totals.update(amount=F('amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(amount))
+                for ingredient_id, amount in delta.items()
+            ),
+            output_field=DecimalField(),
+        ))
+        totals.filter(amount__lte=0).delete()
+
+
+def change_recipe(recipe_id, delta):
+    """Изменение ингредиентов рецепта во всех списках покупок с ним."""
+    if delta:
+        change_totals(
+            ShoppingList.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True),
+            delta,
+        )
+
+
+def rebuild(totals_model, source_model, user_ids=None):
+    """
+    Пересчитывает суммы с нуля (для пользователей user_ids или всех).
+
+    Модели передаются явно, чтобы функцию можно было вызвать
+    из миграции.
+    """
+    totals = totals_model.objects.all()
+    source = source_model.objects.filter(recipe__buyer__isnull=False)
+    if user_ids is not None:
+        totals = totals.filter(user_id__in=user_ids)
+        source = source.filter(recipe__buyer__user__in=user_ids)
+    rows = source.values(
+        'ingredient', user=F('recipe__buyer__user')
+    ).annotate(total=Sum('amount')).order_by()
+    with transaction.atomic():
+        totals.delete()
+        totals_model.objects.bulk_create(
+            (
+                totals_model(
+                    user_id=row['user'], ingredient_id=row['ingredient'],
+                    amount=row['total']
+                )
+                for row in rows.iterator()
+            ),
+            batch_size=1000,
+        )
@@ -0,0 +1,64 @@
+"""
+Денормализованные счётчики рецептов и пользователей.
+
+Счётчики меняются атомарно через F-выражения в сигналах
+(см. recipe.signals). Массовые операции сигналы обходят, после них
+и при расхождениях счётчики сверяются командой reconcile_counters.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# (модель, счётчик, связанная модель, поле связи со счётчиком).
+COUNTERS = (
+    ('recipe.Recipe', 'favorites_count', 'recipe.FavoriteRecipe', 'recipe'),
+    ('recipe.Recipe', 'shopping_cart_count', 'recipe.ShoppingList', 'recipe'),
+    ('users.User', 'recipes_count', 'recipe.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Subscribtion', 'author'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Прибавляет delta к счётчику field, не опуская его ниже нуля."""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def actual_count(related_model, related_field):
+    """Подзапрос с фактическим числом связанных строк."""
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{related_field: OuterRef('pk')}
+        ).order_by().values(related_field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def reconcile(model, field, related_model, related_field,
+              batch_size=1000, dry_run=False):
+    """
+    Пересчитывает разошедшиеся счётчики пачками по batch_size строк.
+
+    Новое значение вычисляется в самом UPDATE, поэтому параллельные
+    изменения через F-выражения не теряются. Возвращает число строк
+    с расхождением.
+    """
+    count = actual_count(related_model, related_field)
+    drifted = 0
+    last_pk = None
+    while True:
+        queryset = model._base_manager.order_by('pk')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return drifted
+        last_pk = pks[-1]
+        pks = list(model._base_manager.filter(pk__in=pks).annotate(
+            actual=count
+        ).exclude(**{field: F('actual')}).values_list('pk', flat=True))
+        drifted += len(pks)
+        if pks and not dry_run:
+            model._base_manager.filter(pk__in=pks).update(**{field: count})
@@ -0,0 +1,37 @@
+"""
+Действия после фиксации транзакции, собранные в один вызов.
+
+Сигналы строк (связи рецепта, ингредиенты) вызывают add() на каждую
+строку; значения копятся в наборе потока и соединения, а func
+получает их все один раз - в первом обработчике on_commit. Остальные
+обработчики той же транзакции находят набор пустым. Регистрация
+обработчика - только добавление в список соединения, без запросов.
+Значения из откатившейся транзакции уходят в следующую фиксацию:
+лишний сброс кэша или переиндексация безвредны, потеря - нет.
+"""
+import threading
+from functools import partial
+
+from django.db import connections, transaction
+
+
+class Deferred:
+    """func(значения, соединение) один раз после фиксации транзакции."""
+
+    def __init__(self, func):
+        self.func = func
+        self.local = threading.local()
+
+    def pending(self, alias):
+        return self.local.__dict__.setdefault(alias, set())
+
+    def add(self, values, using=None):
+        alias = transaction.get_connection(using).alias
+        self.pending(alias).update(values)
+        transaction.on_commit(partial(self.run, alias), using=alias)
+
+    def run(self, alias):
+        values = self.pending(alias)
+        if values:
+            self.local.__dict__[alias] = set()
+            self.func(values, connections[alias])
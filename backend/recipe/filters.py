@@ -1,5 +1,11 @@
 from django_filters import rest_framework as filters
-from .models import Recipe, Tags, Ingredients
+from .models import Recipe, Ingredients
+from .search import search as search_recipes
+from .tag_masks import filter_by_slugs, get_bits
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_bits()]
 
 
 class IngredientFilter(filters.FilterSet):
@@ -14,10 +20,9 @@ class IngredientFilter(filters.FilterSet):
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.filters.ModelMultipleChoiceFilter(
-        queryset=Tags.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
+    # Слаги проверяются и переводятся в биты без запросов к БД.
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method='filter_tags'
     )
     author = filters.CharFilter(lookup_expr='exact')
     is_in_shopping_cart = filters.BooleanFilter(
@@ -26,18 +31,23 @@ class RecipeFilter(filters.FilterSet):
     is_favorited = filters.BooleanFilter(
         field_name='is_favorited', method='filter'
     )
+    search = filters.CharFilter(method='filter_search')
 
     def filter(self, queryset, name, value):
-        if name == 'is_in_shopping_cart' and value:
-            queryset = queryset.filter(
-                buyer__user=self.request.user
-            )
-        if name == 'is_favorited' and value:
-            queryset = queryset.filter(
-                lover__user=self.request.user
-            )
+        # Флаги аннотированы в RecipeViewSet.get_queryset.
+        if name in ('is_in_shopping_cart', 'is_favorited') and value:
+            queryset = queryset.filter(**{name: True})
         return queryset
 
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов, по Recipe.tags_mask."""
+        return filter_by_slugs(queryset, value)
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск, результаты упорядочены по релевантности."""
+        return search_recipes(queryset, value)
+
     class Meta:
         model = Recipe
-        fields = ['author', 'tags', 'is_in_shopping_cart', 'is_favorited']
+        fields = ['author', 'tags', 'is_in_shopping_cart', 'is_favorited',
+                  'search']
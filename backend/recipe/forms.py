@@ -1,8 +1,16 @@
 from django import forms
 from .models import Tags
+from .tag_masks import LIMIT_MESSAGE, free_bits
 
 
 class TagForm(forms.ModelForm):
     class Meta:
         model = Tags
         fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Иначе новый тег упадёт на назначении бита уже при сохранении.
+        if self.instance.bit is None and next(free_bits(), None) is None:
+            raise forms.ValidationError(LIMIT_MESSAGE)
+        return cleaned_data
@@ -0,0 +1,166 @@
+import binascii
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from foodgram.timing import measure
+
+VARIANTS_DIR = 'recipe/variants'
+
+# Размеры соответствуют карточке (240px по высоте) и странице рецепта
+# (480x480) фронтенда с запасом под экраны высокой плотности.
+VARIANTS = {
+    'card': (600, 480),
+    'detail': (960, 960),
+}
+
+# Число символов base64 за одну итерацию декодирования, кратно 4.
+BASE64_CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+class ImageTooLarge(ValueError):
+    """Декодированный файл превышает допустимый размер."""
+
+
+def decode_base64(data, destination, max_size):
+    """
+    Декодирует base64-строку по частям в файл destination.
+
+    В памяти одновременно находится не больше BASE64_CHUNK_SIZE
+    символов; при превышении max_size байт декодирование
+    прерывается. Возвращает размер записанных данных.
+    """
+    size = 0
+    tail = ''
+    for start in range(0, len(data), BASE64_CHUNK_SIZE):
+        chunk = tail + ''.join(data[start:start + BASE64_CHUNK_SIZE].split())
+        cut = len(chunk) - len(chunk) % 4
+        chunk, tail = chunk[:cut], chunk[cut:]
+        decoded = binascii.a2b_base64(chunk)
+        size += len(decoded)
+        if size > max_size:
+            raise ImageTooLarge(size)
+        destination.write(decoded)
+    if tail:
+        raise binascii.Error('Incorrect padding')
+    return size
+
+
+def image_pixels(file):
+    """
+    Число пикселей по заголовку изображения, без декодирования.
+
+    None, если файл не распознан как изображение.
+    """
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        return float('inf')
+    except OSError:
+        return None
+    finally:
+        file.seek(0)
+    return width * height
+
+
+def render_variants(data):
+    """
+    Строит уменьшенные копии изображения.
+
+    Принимает байты исходного файла, возвращает словарь
+    {вариант: {формат: байты}}. Не обращается к БД и хранилищу,
+    поэтому может выполняться в отдельном процессе.
+    """
+    with Image.open(BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source).convert('RGB')
+        variants = {}
+        for variant, size in VARIANTS.items():
+            image = ImageOps.fit(source, size, Image.LANCZOS)
+            variants[variant] = {}
+            for extension, (image_format, options) in FORMATS.items():
+                buffer = BytesIO()
+                image.save(buffer, image_format, **options)
+                variants[variant][extension] = buffer.getvalue()
+    return variants
+
+
+def prepare_image(source, max_size, max_pixels, base_dir=''):
+    """
+    Готовит фото импортируемого рецепта.
+
+    source - строка data:image/...;base64,... или путь к файлу
+    относительно base_dir. Возвращает (расширение, байты исходного
+    файла, варианты как у render_variants). Не обращается к БД,
+    выполняется в пуле процессов; ошибки - ValueError и OSError.
+    """
+    if source.startswith('data:'):
+        header, separator, payload = source.partition(';base64,')
+        if not separator:
+            raise ValueError('Некорректное изображение в формате base64.')
+        extension = header[len('data:'):].split('/')[-1]
+        buffer = BytesIO()
+        try:
+            decode_base64(payload, buffer, max_size)
+        except ImageTooLarge:
+            raise ValueError(f'Размер изображения больше {max_size} байт.')
+        except ValueError:
+            raise ValueError('Некорректное изображение в формате base64.')
+        data = buffer.getvalue()
+    else:
+        path = os.path.join(base_dir, source)
+        if os.path.getsize(path) > max_size:
+            raise ValueError(f'Размер изображения больше {max_size} байт.')
+        with open(path, 'rb') as file:
+            data = file.read()
+        extension = os.path.splitext(path)[1].lstrip('.').lower()
+    pixels = image_pixels(BytesIO(data))
+    if pixels is None:
+        raise ValueError('Файл не является изображением.')
+    if pixels > max_pixels:
+        raise ValueError(f'Изображение больше {max_pixels} пикселей.')
+    return extension or 'jpg', data, render_variants(data)
+
+
+def delete_variants(recipe):
+    storage = recipe.image.storage
+    for formats in recipe.image_variants.values():
+        for name in formats.values():
+            storage.delete(name)
+    recipe.image_variants = {}
+
+
+def save_variants(recipe, variants=None):
+    """
+    Сохраняет варианты изображения рецепта в хранилище.
+
+    Старые варианты удаляются, пути к новым записываются
+    в recipe.image_variants. Рецепт должен быть уже сохранён.
+    """
+    if variants is None:
+        recipe.image.open('rb')
+        try:
+            with measure('image'):
+                variants = render_variants(recipe.image.read())
+        finally:
+            recipe.image.close()
+    delete_variants(recipe)
+    storage = recipe.image.storage
+    stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+    for variant, formats in variants.items():
+        recipe.image_variants[variant] = {
+            extension: storage.save(
+                f'{VARIANTS_DIR}/{stem}_{variant}.{extension}',
+                ContentFile(content)
+            )
+            for extension, content in formats.items()
+        }
+    recipe.save(update_fields=('image_variants',))
+    return recipe.image_variants
@@ -0,0 +1,285 @@
+"""
+Загрузка справочников (ингредиенты, теги) из CSV и JSON.
+
+Файл читается потоком, строки сравниваются с уже существующими
+в памяти по естественному ключу: новые записываются пакетным
+bulk_create(ignore_conflicts=True), на PostgreSQL - через COPY,
+изменившиеся - через bulk_update. Повторная загрузка того же файла
+ничего не меняет. Сигналы при пакетной записи не отправляются,
+поэтому кэши сбрасывает сама команда, см. BaseCatalogCommand.changed.
+"""
+import csv
+import json
+import os
+import time
+from io import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+FORMATS = ('csv', 'json')
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+class JSONArrayReader:
+    """Элементы JSON-массива верхнего уровня, файл читается кусками."""
+
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.eof = False
+
+    def read(self):
+        chunk = self.file.read(JSON_CHUNK_SIZE)
+        self.eof = not chunk
+        self.buffer += chunk
+        return not self.eof
+
+    def peek(self):
+        """Первый непробельный символ, '' в конце файла."""
+        self.buffer = self.buffer.lstrip()
+        while not self.buffer and self.read():
+            self.buffer = self.buffer.lstrip()
+        return self.buffer[:1]
+
+    def decode(self):
+        """Очередной элемент, дочитывая файл, пока он не закончится."""
+        self.peek()
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(self.buffer)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise ValueError('Некорректный JSON.')
+            else:
+                # Число на границе куска могло оборваться.
+                if end < len(self.buffer) or self.eof:
+                    self.buffer = self.buffer[end:]
+                    return item
+            self.read()
+
+    def __iter__(self):
+        if self.peek() != '[':
+            raise ValueError('Ожидался JSON-массив.')
+        self.buffer = self.buffer[1:]
+        if self.peek() == ']':
+            return
+        while True:
+            yield self.decode()
+            separator = self.peek()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError('Ожидалась запятая между элементами.')
+            self.buffer = self.buffer[1:]
+
+
+def read_rows(file, file_format, fields):
+    """Строки файла как кортежи значений fields."""
+    if file_format == 'csv':
+        for row in csv.reader(file):
+            if len(row) == len(fields):
+                yield tuple(row)
+        return
+    for item in JSONArrayReader(file):
+        if isinstance(item, dict) and all(field in item for field in fields):
+            yield tuple(item[field] for field in fields)
+
+
+def copy_insert(model, fields, rows):
+    """
+    INSERT ... ON CONFLICT DO NOTHING из временной таблицы,
+    заполненной через COPY (только PostgreSQL).
+    """
+    table = model._meta.db_table
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(field).column)
+        for field in fields
+    )
+    buffer = StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    temporary = f'{table}_load'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {temporary} ON COMMIT DROP AS '
+            f'SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        cursor.copy_expert(
+            f'COPY {temporary} ({columns}) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) '
+            f'SELECT {columns} FROM {temporary} ON CONFLICT DO NOTHING'
+        )
+        return cursor.rowcount
+
+
+class CatalogLoader:
+    """
+    Сверяет строки с таблицей model по key_fields.
+
+    Остальные из fields обновляются у найденных записей.
+    """
+
+    def __init__(self, model, fields, key_fields, batch_size=1000):
+        self.model = model
+        self.fields = fields
+        self.key_fields = key_fields
+        self.value_fields = [
+            field for field in fields if field not in key_fields
+        ]
+        self.batch_size = batch_size
+        self.timestamps = [
+            field.name for field in model._meta.concrete_fields
+            if getattr(field, 'auto_now', False)
+        ]
+
+    def key(self, row):
+        return tuple(
+            value for field, value in zip(self.fields, row)
+            if field in self.key_fields
+        )
+
+    def existing(self):
+        """{ключ: (pk, значения остальных полей)} по всей таблице."""
+        rows = self.model.objects.values_list(
+            'pk', *self.key_fields, *self.value_fields
+        ).order_by().iterator()
+        size = len(self.key_fields)
+        return {
+            tuple(row[1:size + 1]): (row[0], tuple(row[size + 1:]))
+            for row in rows
+        }
+
+    def diff(self, rows):
+        """Возвращает (новые строки, [(pk, строка)] изменённых, всего)."""
+        existing = self.existing()
+        created = {}
+        changed = {}
+        total = 0
+        for row in rows:
+            total += 1
+            key = self.key(row)
+            values = tuple(
+                value for field, value in zip(self.fields, row)
+                if field not in self.key_fields
+            )
+            if key not in existing:
+                created[key] = row
+            elif existing[key][1] != values:
+                changed[key] = (existing[key][0], row)
+        return list(created.values()), list(changed.values()), total
+
+    def create(self, rows):
+        """Записывает новые строки, возвращает число вставленных."""
+        if not rows:
+            return 0
+        now = timezone.now()
+        if connection.vendor == 'postgresql':
+            return copy_insert(
+                self.model, [*self.fields, *self.timestamps],
+                (row + (now,) * len(self.timestamps) for row in rows)
+            )
+        before = self.model.objects.count()
+        self.model.objects.bulk_create(
+            (self.model(**dict(zip(self.fields, row))) for row in rows),
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        return self.model.objects.count() - before
+
+    def update(self, rows):
+        if not rows:
+            return
+        now = timezone.now()
+        objects = []
+        for pk, row in rows:
+            instance = self.model(pk=pk, **dict(zip(self.fields, row)))
+            for field in self.timestamps:
+                setattr(instance, field, now)
+            objects.append(instance)
+        self.model.objects.bulk_update(
+            objects, [*self.value_fields, *self.timestamps],
+            batch_size=self.batch_size,
+        )
+
+
+class BaseCatalogCommand(BaseCommand):
+    """Общая часть команд load_ingredients и load_tags."""
+
+    model = None
+    fields = ()
+    key_fields = ()
+    default_path = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=self.default_path,
+            help='CSV or JSON file (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='File format, by default taken from the extension.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report what would change.',
+        )
+
+    def validate(self, new):
+        """
+        Проверяет новые строки до записи, ошибка - CommandError.
+        """
+
+    def changed(self, created, changed):
+        """
+        Сбрасывает кэши после записи: created - число новых строк,
+        changed - pk изменённых.
+        """
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        file_format = (
+            options['format']
+            or os.path.splitext(path)[1].lstrip('.').lower()
+        )
+        if file_format not in FORMATS:
+            raise CommandError(
+                f'Unknown file format "{file_format}", use --format.')
+        loader = CatalogLoader(
+            self.model, self.fields, self.key_fields, batch_size)
+        started = time.perf_counter()
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                new, changed, total = loader.diff(
+                    read_rows(file, file_format, self.fields))
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        read = time.perf_counter() - started
+        self.validate(new)
+        created = 0
+        if not dry_run:
+            with transaction.atomic():
+                created = loader.create(new)
+                loader.update(changed)
+                self.changed(created, [pk for pk, _ in changed])
+        self.stdout.write(
+            f'{total} rows read in {read:.2f}s: {len(new)} new, '
+            f'{len(changed)} changed, '
+            f'{total - len(new) - len(changed)} unchanged.'
+        )
+        if dry_run:
+            self.stdout.write('Dry run, nothing written.')
+        else:
+            self.stdout.write(
+                f'{created} created, {len(changed)} updated in '
+                f'{time.perf_counter() - started:.2f}s.'
+            )
@@ -0,0 +1,471 @@
+import base64
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import namedtuple
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.urls import URLResolver, get_resolver, reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipe import search, tag_masks
+from recipe.models import (FavoriteRecipe, Ingredients, IngredientsInRecipe,
+                           Recipe, ShoppingList, Tags, TagsRecipe)
+from users.models import Subscribtion, User
+
+NAMESPACES = ('users', 'recipes')
+PASSWORD = 'budget-password-1'
+# Запас, с которым --update записывает бюджеты времени.
+TIME_MARGIN = 3
+# Ингредиентов в записываемых рецептах на самом большом размере;
+# на меньших их size, так что рост запросов с числом строк связей
+# виден при сравнении размеров.
+RECIPE_INGREDIENTS = 30
+
+# route - имя URL, kwargs - {аргумент URL: ключ объекта из seed},
+# query и data могут ссылаться на объекты и размер как {size},
+# note отличает метки проверок одного маршрута с разными данными.
+Check = namedtuple(
+    'Check',
+    ('route', 'method', 'auth', 'status', 'kwargs', 'query', 'data',
+     'note'),
+    defaults=(None, None, None, None),
+)
+
+RECIPE_DATA = {
+    'name': 'Проверочный рецепт',
+    'text': 'Описание',
+    'cooking_time': 10,
+    'tags': ['{tag}'],
+    'ingredients': '{ingredients}',
+    'image': '{image}',
+}
+# Заменяет все ингредиенты рецепта другими.
+RECIPE_SWAP_DATA = {'ingredients': '{other_ingredients}'}
+# Оставляет два ингредиента рецепта с новым количеством, остальные удаляет.
+RECIPE_PATCH_DATA = dict(RECIPE_DATA, ingredients='{few_ingredients}')
+
+CHECKS = (
+    Check('users:api-root', 'get', False, 200),
+    Check('recipes:tags-list', 'get', False, 200),
+    Check('recipes:tags-list', 'get', True, 200),
+    Check('recipes:tags-detail', 'get', False, 200, {'pk': 'tag'}),
+    Check('recipes:ingredients-list', 'get', False, 200),
+    Check('recipes:ingredients-list', 'get', False, 200,
+          query={'name': 'ингр'}),
+    Check('recipes:ingredients-detail', 'get', False, 200,
+          {'pk': 'ingredient'}),
+    Check('recipes:recipes-list', 'get', False, 200,
+          query={'limit': '{size}'}),
+    Check('recipes:recipes-list', 'get', True, 200,
+          query={'limit': '{size}'}),
+    Check('recipes:recipes-list', 'get', True, 200,
+          query={'limit': '{size}', 'is_favorited': 1}),
+    Check('recipes:recipes-list', 'get', True, 200,
+          query={'limit': '{size}', 'is_in_shopping_cart': 1}),
+    Check('recipes:recipes-list', 'get', False, 200,
+          query={'limit': '{size}', 'tags': 'budget-0'}),
+    Check('recipes:recipes-list', 'get', False, 200,
+          query={'limit': '{size}', 'author': '{author}'}),
+    Check('recipes:recipes-list', 'get', False, 200,
+          query={'limit': '{size}', 'search': 'рецепт'}),
+    Check('recipes:recipes-list', 'get', True, 200,
+          query={'limit': '{size}', 'pagination': 'cursor'}),
+    Check('recipes:recipes-detail', 'get', False, 200, {'pk': 'recipe'}),
+    Check('recipes:recipes-detail', 'get', True, 200, {'pk': 'recipe'}),
+    Check('recipes:recipes-shopping-cart-totals', 'get', True, 200),
+    Check('recipes:recipes-download-shopping-cart', 'get', True, 200),
+    Check('recipes:recipes-download-shopping-cart', 'get', True, 200,
+          query={'format': 'csv'}),
+    Check('recipes:recipes-download-shopping-cart', 'get', True, 200,
+          query={'format': 'pdf'}),
+    Check('recipes:recipes-list', 'post', True, 201, data=RECIPE_DATA),
+    Check('recipes:recipes-detail', 'patch', True, 200,
+          {'pk': 'own_recipe'}, data=RECIPE_SWAP_DATA,
+          note='all ingredients replaced'),
+    Check('recipes:recipes-detail', 'patch', True, 200,
+          {'pk': 'own_recipe'}, data=RECIPE_PATCH_DATA),
+    Check('recipes:recipes-favorite', 'post', True, 201,
+          {'pk': 'spare_recipe'}),
+    Check('recipes:recipes-favorite', 'delete', True, 204,
+          {'pk': 'spare_recipe'}),
+    Check('recipes:recipes-shopping-cart', 'post', True, 201,
+          {'pk': 'spare_recipe'}),
+    Check('recipes:recipes-shopping-cart', 'delete', True, 204,
+          {'pk': 'spare_recipe'}),
+    Check('recipes:recipes-detail', 'delete', True, 204,
+          {'pk': 'doomed_recipe'}),
+    Check('users:users-list', 'get', False, 200,
+          query={'limit': '{size}'}),
+    Check('users:users-list', 'get', True, 200,
+          query={'limit': '{size}'}),
+    Check('users:users-detail', 'get', False, 200, {'id': 'author'}),
+    Check('users:users-detail', 'get', True, 200, {'id': 'author'}),
+    Check('users:users-me', 'get', True, 200),
+    Check('users:users-subscriptions', 'get', True, 200,
+          query={'limit': '{size}', 'recipes_limit': 3}),
+    Check('users:users-subscribe', 'post', True, 201,
+          {'id': 'spare_author'}),
+    Check('users:users-subscribe', 'delete', True, 204,
+          {'id': 'spare_author'}),
+    Check('users:users-list', 'post', False, 201, data={
+        'email': 'new@example.com', 'username': 'new',
+        'first_name': 'Новый', 'last_name': 'Пользователь',
+        'password': PASSWORD,
+    }),
+    Check('users:login', 'post', False, 200, data={
+        'email': 'budget@example.com', 'password': PASSWORD,
+    }),
+    Check('users:users-set-password', 'post', True, 204, data={
+        'current_password': PASSWORD, 'new_password': PASSWORD,
+    }),
+    Check('users:users-set-username', 'post', True, 400, data={
+        'current_password': PASSWORD, 'new_username': 'budget',
+    }),
+    Check('users:users-activation', 'post', False, 400,
+          data={'uid': 'x', 'token': 'x'}),
+    Check('users:users-resend-activation', 'post', False, 400,
+          data={'email': 'budget@example.com'}),
+    # Неизвестный email: письма djoser требуют *_CONFIRM_URL в настройках.
+    Check('users:users-reset-password', 'post', False, 204,
+          data={'email': 'nobody@example.com'}),
+    Check('users:users-reset-password-confirm', 'post', False, 400,
+          data={'uid': 'x', 'token': 'x', 'new_password': PASSWORD}),
+    Check('users:users-reset-username', 'post', False, 204,
+          data={'email': 'nobody@example.com'}),
+    Check('users:users-reset-username-confirm', 'post', False, 400,
+          data={'uid': 'x', 'token': 'x', 'new_username': 'x'}),
+    # Удаляет токен, поэтому последний.
+    Check('users:logout', 'post', True, 204),
+)
+
+
+def check_label(check):
+    query = ''.join(f' {name}={value}' for name, value in sorted(
+        (check.query or {}).items()))
+    auth = 'user' if check.auth else 'anonymous'
+    note = f' [{check.note}]' if check.note else ''
+    return f'{check.method.upper()} {check.route}{query} ({auth}){note}'
+
+
+def resolve(value, objects):
+    """Подставляет в value объекты из seed вместо {ключ}."""
+    if isinstance(value, dict):
+        return {key: resolve(item, objects) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, objects) for item in value]
+    if isinstance(value, str) and value.startswith('{'):
+        return objects[value[1:-1]]
+    return value
+
+
+def api_routes():
+    """Имена URL приложений, без дублей одного шаблона (djoser)."""
+    routes = {}
+
+    def walk(patterns, namespace, prefix):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(
+                    pattern.url_patterns,
+                    pattern.namespace or namespace,
+                    prefix + str(pattern.pattern),
+                )
+            elif namespace in NAMESPACES and pattern.name:
+                routes.setdefault(
+                    prefix + str(pattern.pattern),
+                    f'{namespace}:{pattern.name}'
+                )
+
+    walk(get_resolver().url_patterns, None, '')
+    return set(routes.values())
+
+
+def image_data():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), 'orange').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+def seed(size):
+    """
+    size авторов и 2 * size рецептов: у пользователя budget все они
+    в избранном и корзине, он подписан на всех авторов. Два его
+    собственных рецепта для PATCH и DELETE содержат по
+    min(size, RECIPE_INGREDIENTS) ингредиентов.
+    """
+    # bulk_create на SQLite не проставляет id, объекты читаются заново.
+    Tags.objects.bulk_create(
+        Tags(name=f'Тег {number}', color=f'#00000{number}',
+             slug=f'budget-{number}', bit=number)
+        for number in range(3)
+    )
+    tags = list(Tags.objects.order_by('id'))
+    Ingredients.objects.bulk_create(
+        Ingredients(name=f'ингредиент {number}', measurement_unit='г')
+        for number in range(max(size, 2 * RECIPE_INGREDIENTS))
+    )
+    ingredients = list(Ingredients.objects.order_by('id'))
+    user = User.objects.create_user(
+        username='budget', email='budget@example.com', password=PASSWORD,
+        first_name='Бюджет', last_name='Запросов',
+    )
+    User.objects.bulk_create(
+        User(username=f'author{number}', email=f'author{number}@example.com',
+             first_name='Автор', last_name=str(number))
+        for number in range(size + 1)
+    )
+    authors = list(
+        User.objects.filter(username__startswith='author').order_by('id'))
+    *authors, spare_author = authors
+    Recipe.objects.bulk_create(
+        Recipe(author=authors[number % size], name=f'Рецепт {number}',
+               text='Описание рецепта', cooking_time=number % 60 + 1,
+               image='recipe/budget.png')
+        for number in range(2 * size)
+    )
+    recipes = list(Recipe.objects.order_by('id'))
+    own_recipe, doomed_recipe = (
+        Recipe.objects.create(
+            author=user, name=name, text='Описание', cooking_time=5,
+            image='recipe/budget.png',
+        )
+        for name in ('Свой рецепт', 'Удаляемый рецепт')
+    )
+    count = min(size, RECIPE_INGREDIENTS)
+    own_ingredients = ingredients[:count]
+    IngredientsInRecipe.objects.bulk_create(
+        IngredientsInRecipe(recipe=recipe, ingredient=ingredient,
+                            amount=Decimal(10))
+        for recipe in (own_recipe, doomed_recipe)
+        for ingredient in own_ingredients
+    )
+    IngredientsInRecipe.objects.bulk_create(
+        IngredientsInRecipe(recipe=recipe, ingredient=ingredients[
+            (recipe.id + shift) % size], amount=Decimal(10))
+        for recipe in recipes for shift in range(min(size, 3))
+    )
+    TagsRecipe.objects.bulk_create(
+        TagsRecipe(recipe=recipe, tag=tags[recipe.id % len(tags)])
+        for recipe in recipes
+    )
+    *recipes, spare_recipe = recipes
+    FavoriteRecipe.objects.bulk_create(
+        FavoriteRecipe(user=user, recipe=recipe) for recipe in recipes)
+    ShoppingList.objects.bulk_create(
+        ShoppingList(user=user, recipe=recipe) for recipe in recipes)
+    Subscribtion.objects.bulk_create(
+        Subscribtion(user=user, author=author) for author in authors)
+    # Пакетная запись обходит сигналы.
+    call_command('reconcile_counters', stdout=StringIO())
+    tag_masks.rebuild()
+    search.update_index()
+    return user, {
+        'size': size,
+        'tag': tags[0].id,
+        'ingredient': ingredients[0].id,
+        'ingredients': [
+            {'id': ingredient.id, 'amount': 5}
+            for ingredient in own_ingredients
+        ],
+        'other_ingredients': [
+            {'id': ingredient.id, 'amount': 5}
+            for ingredient in ingredients[count:2 * count]
+        ],
+        'few_ingredients': [
+            {'id': ingredient.id, 'amount': 7}
+            for ingredient in own_ingredients[:2]
+        ],
+        'author': authors[0].id,
+        'spare_author': spare_author.id,
+        'recipe': recipes[0].id,
+        'spare_recipe': spare_recipe.id,
+        'own_recipe': own_recipe.id,
+        'doomed_recipe': doomed_recipe.id,
+        'image': image_data(),
+    }
+
+
+Measurement = namedtuple('Measurement', ('status', 'queries', 'ms'))
+
+
+class Command(BaseCommand):
+    """
+    Бюджеты числа запросов к БД и времени ответа для всех маршрутов API.
+
+    Во временной тестовой базе данные создаются несколько раз
+    с разным размером страницы (--sizes). Каждый маршрут запрашивается
+    анонимно и/или от пользователя с пустым кэшем. Проверка падает,
+    если число запросов зависит от размера данных (N+1), если оно
+    больше записанного в файле бюджетов или если медиана времени
+    на самом большом размере больше бюджета. --update записывает
+    текущие значения как новые бюджеты.
+    """
+    help = ('Check query count and response time budgets of every API '
+            'route on a temporary test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 500],
+            help='Rows per page to seed and compare.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Timed runs of each read request (median is used).',
+        )
+        parser.add_argument(
+            '--budgets',
+            default=os.path.join(settings.BASE_DIR, 'api_budgets.json'),
+            help='Budgets file (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Write measured values to the budgets file.',
+        )
+
+    def handle(self, *args, **options):
+        missing = api_routes() - {check.route for check in CHECKS}
+        if missing:
+            raise CommandError(
+                f'Routes without checks: {", ".join(sorted(missing))}.')
+        self.repeat = options['repeat']
+        sizes = sorted(options['sizes'])
+        results = self.run(sizes)
+        if options['update']:
+            self.save_budgets(options['budgets'], results[sizes[-1]])
+            return
+        failures = self.compare(
+            results, sizes, self.load_budgets(options['budgets']))
+        if failures:
+            raise CommandError(f'{failures} checks over budget.')
+        self.stdout.write(self.style.SUCCESS('All checks within budget.'))
+
+    def run(self, sizes):
+        """{размер: {метка проверки: Measurement}}."""
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as media, override_settings(
+                MEDIA_ROOT=media,
+                CACHES={alias: {
+                    'BACKEND':
+                        'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': f'api-budgets-{alias}',
+                } for alias in ('default', 'versions')},
+            ):
+                results = {}
+                for size in sizes:
+                    call_command('flush', interactive=False, verbosity=0)
+                    results[size] = self.measure_all(*seed(size))
+                return results
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def measure_all(self, user, objects):
+        anonymous = Client()
+        authorized = Client(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user)}')
+        results = {}
+        for check in CHECKS:
+            client = authorized if check.auth else anonymous
+            runs = self.repeat if check.method == 'get' else 1
+            measurements = [
+                self.measure(client, check, objects) for _ in range(runs)
+            ]
+            results[check_label(check)] = Measurement(
+                measurements[-1].status,
+                max(measurement.queries for measurement in measurements),
+                statistics.median(
+                    measurement.ms for measurement in measurements),
+            )
+        return results
+
+    def measure(self, client, check, objects):
+        url = reverse(check.route, kwargs={
+            name: objects[key] for name, key in (check.kwargs or {}).items()
+        })
+        if check.method == 'get':
+            arguments = (resolve(check.query or {}, objects),)
+        else:
+            arguments = (json.dumps(resolve(check.data or {}, objects)),
+                         'application/json')
+        # Пустой кэш, чтобы запросы к БД не прятались за ним; новые
+        # поколения перестраивают и снимки справочников в памяти.
+        for alias in ('default', 'versions'):
+            caches[alias].clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, check.method)(url, *arguments)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != check.status:
+            raise CommandError(
+                f'{check_label(check)}: expected {check.status}, '
+                f'got {response.status_code}.')
+        return Measurement(response.status_code, len(queries), elapsed)
+
+    def load_budgets(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except OSError:
+            self.stderr.write(
+                f'No budgets file {path}, run with --update to create it.')
+            return {}
+
+    def save_budgets(self, path, results):
+        budgets = {
+            label: {
+                'queries': measurement.queries,
+                'ms': round(measurement.ms * TIME_MARGIN + 1),
+            }
+            for label, measurement in results.items()
+        }
+        with open(path, 'w') as file:
+            json.dump(budgets, file, ensure_ascii=False, indent=2,
+                      sort_keys=True)
+            file.write('\n')
+        self.stdout.write(f'{len(budgets)} budgets written to {path}.')
+
+    def compare(self, results, sizes, budgets):
+        """Печатает таблицу и возвращает число проваленных проверок."""
+        failures = 0
+        for label, measurement in results[sizes[-1]].items():
+            queries = [results[size][label].queries for size in sizes]
+            budget = budgets.get(label, {})
+            problems = []
+            if len(set(queries)) > 1:
+                problems.append('queries grow with data')
+            if measurement.queries > budget.get('queries', float('inf')):
+                problems.append(f'queries > {budget["queries"]}')
+            if measurement.ms > budget.get('ms', float('inf')):
+                problems.append(f'time > {budget["ms"]} ms')
+            failures += bool(problems)
+            line = (
+                f'{label}: queries {"/".join(map(str, queries))}, '
+                f'{measurement.ms:.1f} ms'
+            )
+            if problems:
+                self.stdout.write(self.style.ERROR(
+                    f'{line} - {", ".join(problems)}'))
+            else:
+                self.stdout.write(line)
+        return failures
@@ -0,0 +1,184 @@
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from recipe.filters import RecipeFilter
+from recipe.models import ShoppingList, Tags
+from recipe.shopping_list import get_items
+from recipe.views import RecipeViewSet
+from users.models import User
+from users.pagination import LimitCursorPagination
+from users.serializers import rank_recipes
+
+# sort - сортировка допустима: она идёт по выборке одного
+# пользователя или автора, а не по всей таблице.
+Query = namedtuple('Query', ('name', 'queryset', 'sort'))
+
+# Полный просмотр таблицы (имя или псевдоним) и сортировка в плане.
+PATTERNS = {
+    'postgresql': (
+        re.compile(r'Seq Scan on (\w+)'),
+        re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort\b', re.MULTILINE),
+    ),
+    'sqlite': (
+        re.compile(r'\bSCAN (?:TABLE )?(\w+)(?: AS \w+)?$', re.MULTILINE),
+        re.compile(r'USE TEMP B-TREE FOR (?:ORDER BY|DISTINCT)'),
+    ),
+}
+# Псевдонимы таблиц в подзапросах Django: "recipe_recipe" U0.
+ALIAS = re.compile(r'"(\w+)" ([A-Z]\d+)\b')
+
+
+class Command(BaseCommand):
+    """
+    Проверяет планы основных запросов API через EXPLAIN.
+
+    Запросы строятся тем же кодом, что и в API: RecipeViewSet,
+    RecipeFilter, подписки и выгрузка списка покупок. Замечанием
+    считается полный просмотр таблицы, в которой не меньше --min-rows
+    строк, и сортировка там, где её должен заменить индекс.
+    Планы зависят от данных и статистики, поэтому команду имеет смысл
+    запускать на базе, близкой к рабочей (см. generate_dataset).
+    """
+    help = ('Run EXPLAIN on the hot-path API queries and report '
+            'sequential scans and sorts on large tables.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int,
+            help='Id of the user whose lists are queried '
+                 '(default: a user with a shopping cart).',
+        )
+        parser.add_argument(
+            '--author', type=int,
+            help='Id of the author (default: the most prolific one).',
+        )
+        parser.add_argument(
+            '--tags', nargs='+',
+            help='Tag slugs to filter by (default: the first two tags).',
+        )
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='Tables with fewer rows may be scanned.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in PATTERNS:
+            raise CommandError(
+                f'EXPLAIN parsing is not supported for {connection.vendor}.')
+        self.min_rows = options['min_rows']
+        self.rows = {}
+        self.tables = set(connection.introspection.table_names())
+        user = self.get_user(options['user'])
+        author = options['author'] or User.objects.order_by(
+            '-recipes_count').values_list('id', flat=True).first()
+        tags = options['tags'] or list(
+            Tags.objects.order_by('id').values_list('slug', flat=True)[:2])
+        problems = 0
+        for query in self.queries(user, author, tags):
+            plan = query.queryset.explain()
+            issues = self.check_plan(query, plan)
+            problems += bool(issues)
+            if issues:
+                self.stdout.write(self.style.WARNING(
+                    f'{query.name}: {"; ".join(issues)}'))
+            else:
+                self.stdout.write(f'{query.name}: OK')
+            if options['verbosity'] > 1:
+                self.stdout.write(plan + '\n')
+        if problems:
+            raise CommandError(f'{problems} queries need attention.')
+        self.stdout.write(self.style.SUCCESS('All query plans use indexes.'))
+
+    def get_user(self, pk):
+        if pk is None:
+            pk = ShoppingList.objects.values_list('user', flat=True).first()
+        user = User.objects.filter(pk=pk).first() if pk else None
+        if user is None:
+            user = User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('The database has no users.')
+        return user
+
+    def queries(self, user, author, tags):
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        feed = RecipeViewSet(request=self.fake_request(AnonymousUser()))
+        lists = RecipeViewSet(request=self.fake_request(user))
+
+        def recipes(view, **data):
+            return RecipeFilter(
+                data, queryset=view.get_queryset()).qs[:page_size]
+
+        subscriptions = User.objects.filter(
+            following__user=user).order_by('-id')[:page_size]
+        return (
+            Query('recipes', recipes(feed), False),
+            Query('recipes cursor', self.cursor_page(feed, page_size), False),
+            Query('recipes by author', recipes(feed, author=author), False),
+            Query('recipes by tags', recipes(feed, tags=tags), False),
+            Query('favorited recipes',
+                  recipes(lists, is_favorited='true'), True),
+            Query('shopping cart recipes',
+                  recipes(lists, is_in_shopping_cart='true'), True),
+            Query('subscriptions', subscriptions, True),
+            Query('subscription recipes',
+                  rank_recipes(list(subscriptions)), True),
+            Query('shopping list', get_items(user), True),
+        )
+
+    @staticmethod
+    def cursor_page(view, page_size):
+        """Страница курсора после самого нового рецепта."""
+        paginator = LimitCursorPagination()
+        queryset = view.get_queryset().order_by(*paginator.ordering)
+        latest = queryset.first()
+        if latest is None:
+            return queryset[:page_size]
+        return queryset.filter(paginator.after(
+            paginator.get_position(latest), paginator.ordering
+        ))[:page_size]
+
+    @staticmethod
+    def fake_request(user):
+        """Запрос для get_queryset, которому нужен только пользователь."""
+        request = type('Request', (), {})()
+        request.user = user
+        return request
+
+    def check_plan(self, query, plan):
+        scan, sort = PATTERNS[connection.vendor]
+        sql, _ = query.queryset.query.sql_with_params()
+        aliases = {
+            alias.lower(): table for table, alias in ALIAS.findall(sql)
+        }
+        issues = []
+        for name in scan.findall(plan):
+            table = aliases.get(name.lower(), name)
+            if table not in self.tables:
+                continue
+            rows = self.table_rows(table)
+            if rows >= self.min_rows:
+                issues.append(f'full scan of {table} ({rows} rows)')
+        if not query.sort and sort.search(plan):
+            issues.append('sort')
+        return issues
+
+    def table_rows(self, table):
+        """Число строк; на PostgreSQL - оценка из статистики."""
+        if table not in self.rows:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(
+                        'SELECT reltuples::bigint FROM pg_class '
+                        'WHERE relname = %s', (table,))
+                else:
+                    cursor.execute(
+                        'SELECT COUNT(*) FROM '
+                        f'{connection.ops.quote_name(table)}')
+                row = cursor.fetchone()
+            self.rows[table] = row[0] if row else 0
+        return self.rows[table]
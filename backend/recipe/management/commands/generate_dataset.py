@@ -0,0 +1,373 @@
+import random
+import time
+from array import array
+from bisect import bisect
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from io import BytesIO
+from itertools import accumulate
+
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from PIL import Image
+
+from recipe import cache, search
+from recipe.cart_totals import rebuild
+from recipe.counters import COUNTERS, reconcile
+from recipe.loaders import copy_insert
+from recipe.tag_masks import mask
+from recipe.models import (FavoriteRecipe, Ingredients, IngredientsInRecipe,
+                           IngredientsInShoppingList, Recipe, ShoppingList,
+                           Tags, TagsRecipe)
+from users.models import Subscribtion, User
+
+IMAGE_NAME = 'recipe/generated.jpg'
+IMAGE_SIZE = (600, 480)
+
+ADJECTIVES = (
+    'Домашний', 'Быстрый', 'Летний', 'Острый', 'Сытный', 'Бабушкин',
+    'Постный', 'Праздничный', 'Лёгкий', 'Деревенский',
+)
+DISHES = (
+    'суп', 'салат', 'пирог', 'омлет', 'плов', 'рагу', 'борщ', 'гуляш',
+    'десерт', 'соус', 'кекс', 'завтрак', 'ужин', 'гарнир',
+)
+WORDS = (
+    'нарезать', 'смешать', 'обжарить', 'довести', 'до', 'кипения',
+    'посолить', 'добавить', 'тушить', 'минут', 'на', 'медленном', 'огне',
+    'подавать', 'горячим', 'остудить', 'взбить', 'запекать', 'в',
+    'духовке', 'с', 'зеленью', 'и', 'специями', 'по', 'вкусу',
+)
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей', 'Елена')
+LAST_NAMES = ('Иванова', 'Петров', 'Смирнова', 'Кузнецов', 'Попова')
+
+
+class Zipf:
+    """
+    Выбор из population с весом 1 / rank ** exponent.
+
+    Популярность назначается в случайном порядке, так что самые
+    популярные элементы не совпадают с первыми по id.
+    """
+
+    def __init__(self, rng, population, exponent):
+        self.rng = rng
+        self.population = list(population)
+        rng.shuffle(self.population)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent
+            for rank in range(1, len(self.population) + 1)
+        ))
+        self.total = self.cum_weights[-1]
+
+    def choice(self):
+        return self.population[
+            bisect(self.cum_weights, self.rng.random() * self.total)
+        ]
+
+    def sample(self, count, skip=None):
+        """До count разных элементов, кроме тех, для которых skip()."""
+        count = min(count, len(self.population))
+        chosen = set()
+        # Ограничение попыток на случай сильного перекоса весов
+        # или если skip отсекает почти всё.
+        for _ in range(count * 10):
+            if len(chosen) >= count:
+                break
+            item = self.choice()
+            if skip is None or not skip(item):
+                chosen.add(item)
+        return chosen
+
+
+def insert_rows(model, fields, rows):
+    """
+    Пакетная вставка строк без создания объектов моделей.
+
+    На PostgreSQL - через COPY, на остальных СУБД - executemany.
+    Значения должны быть уже приведены к виду для БД.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    if connection.vendor == 'postgresql':
+        copy_insert(model, fields, rows)
+        return
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(field).column)
+        for field in fields
+    )
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {model._meta.db_table} ({columns}) '
+            f'VALUES ({placeholders})',
+            rows
+        )
+
+
+def placeholder_image():
+    """Одно фото на все сгенерированные рецепты, без вариантов."""
+    storage = Recipe._meta.get_field('image').storage
+    if storage.exists(IMAGE_NAME):
+        return IMAGE_NAME
+    buffer = BytesIO()
+    Image.new('RGB', IMAGE_SIZE, (230, 170, 90)).save(buffer, 'JPEG')
+    return storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+
+
+class Command(BaseCommand):
+    """
+    Генерирует синтетические данные для нагрузочного тестирования.
+
+    Авторы выбираются по закону Ципфа: немногие популярные авторы
+    пишут большую часть рецептов и собирают большую часть подписок,
+    так же распределены ингредиенты и популярность рецептов
+    в избранном и корзинах. Строки вставляются пакетами в обход
+    ORM и сигналов, поэтому в конце пересчитываются счётчики,
+    суммы списков покупок и поисковый индекс и сбрасывается кэш.
+    Теги и ингредиенты должны быть загружены заранее.
+    """
+    help = ('Generate users, recipes, favorites, shopping carts and '
+            'subscriptions for load testing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Average favorites per user.',
+        )
+        parser.add_argument(
+            '--cart', type=float, default=3,
+            help='Average shopping cart recipes per user.',
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=5,
+            help='Average subscriptions per user.',
+        )
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Zipf exponent of author, ingredient and recipe '
+                 'popularity.',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Publication dates are spread over this many days.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='cook',
+            help='Usernames and emails are <prefix><id>.',
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--password', default='password',
+            help='Password of every generated user.',
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be positive.')
+        if options['recipes'] < 0:
+            raise CommandError('--recipes must not be negative.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # {id тега: бит в маске}
+        self.tags = dict(Tags.objects.order_by('id').values_list(
+            'id', 'bit'))
+        ingredients = Ingredients.objects.order_by('id').values_list(
+            'id', flat=True)
+        if not self.tags or not ingredients.exists():
+            raise CommandError(
+                'Load tags and ingredients first '
+                '(load_tags, load_ingredients).')
+        self.ingredients = Zipf(self.rng, ingredients, options['zipf'])
+        self.now = timezone.now()
+        self.started = time.perf_counter()
+
+        users = self.create_users(
+            options['users'], options['password'], options['prefix'])
+        self.authors = Zipf(self.rng, users, options['zipf'])
+        # Авторы рецептов по порядку id, чтобы не добавлять свои рецепты
+        # в избранное и корзину.
+        self.recipe_authors = array('q')
+        recipes = self.create_recipes(options['recipes'], options['days'])
+        if recipes:
+            popular = Zipf(self.rng, recipes, options['zipf'])
+
+            def own_recipe(user, recipe):
+                return self.recipe_authors[recipe - recipes.start] == user
+
+            self.create_relations(
+                FavoriteRecipe, ('user', 'recipe'), users, popular,
+                options['favorites'], skip=own_recipe,
+            )
+            self.create_relations(
+                ShoppingList, ('user', 'recipe'), users, popular,
+                options['cart'], skip=own_recipe,
+            )
+        self.create_relations(
+            Subscribtion, ('user', 'author'), users, self.authors,
+            options['subscriptions'], skip=lambda user, author: user == author,
+        )
+        self.reset_sequences()
+        self.update_derived()
+        self.report('Done')
+
+    def report(self, message):
+        self.stdout.write(
+            f'[{time.perf_counter() - self.started:.1f}s] {message}')
+
+    def datetime(self, value):
+        return connection.ops.adapt_datetimefield_value(value)
+
+    def batches(self, start, stop):
+        for first in range(start, stop, self.batch_size):
+            yield range(first, min(first + self.batch_size, stop))
+
+    def check_usernames(self, start, count, prefix):
+        """Имена заняты - ошибка до записи первой пачки."""
+        for ids in self.batches(start, start + count):
+            taken = User.objects.filter(
+                Q(username__in=[f'{prefix}{pk}' for pk in ids])
+                | Q(email__in=[f'{prefix}{pk}@example.com' for pk in ids])
+            ).values_list('username', flat=True).first()
+            if taken is not None:
+                raise CommandError(
+                    f'User {taken} clashes with generated names, '
+                    'use another --prefix.')
+
+    def create_users(self, count, password, prefix):
+        start = (User.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        self.check_usernames(start, count, prefix)
+        password = make_password(password)
+        joined = self.datetime(self.now)
+        fields = (
+            'id', 'username', 'email', 'first_name', 'last_name',
+            'password', 'role', 'is_superuser', 'is_staff', 'is_active',
+            'date_joined', 'recipes_count', 'followers_count',
+        )
+        for ids in self.batches(start, start + count):
+            with transaction.atomic():
+                insert_rows(User, fields, (
+                    (
+                        pk, f'{prefix}{pk}', f'{prefix}{pk}@example.com',
+                        self.rng.choice(FIRST_NAMES),
+                        self.rng.choice(LAST_NAMES),
+                        password, User.USER, False, False, True, joined, 0, 0,
+                    )
+                    for pk in ids
+                ))
+        self.report(f'{count} users')
+        return range(start, start + count)
+
+    def recipe_row(self, pk, pub_date, image, tags):
+        words = self.rng.choices(WORDS, k=self.rng.randint(20, 80))
+        return (
+            pk, self.authors.choice(),
+            f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(DISHES)} {pk}',
+            ' '.join(words).capitalize() + '.',
+            # Чаще всего 20-60 минут, изредка несколько часов.
+            min(max(int(self.rng.lognormvariate(3.5, 0.6)), 1), 600),
+            image, '{}', pub_date, pub_date, 0, 0,
+            mask(self.tags[tag] for tag in tags),
+        )
+
+    def ingredient_rows(self, pk):
+        count = min(max(int(self.rng.gauss(8, 3)), 2), 20)
+        for ingredient in self.ingredients.sample(count):
+            yield pk, ingredient, Decimal(self.rng.randint(1, 100) * 10)
+
+    def choose_tags(self):
+        count = self.rng.choices((1, 2, 3), weights=(5, 3, 1))[0]
+        return self.rng.sample(list(self.tags), min(count, len(self.tags)))
+
+    def create_recipes(self, count, days):
+        start = (Recipe.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        image = placeholder_image()
+        first_date = self.now - timedelta(days=days)
+        step = timedelta(days=days) / max(count, 1)
+        fields = (
+            'id', 'author', 'name', 'text', 'cooking_time', 'image',
+            'image_variants', 'pub_date', 'updated', 'favorites_count',
+            'shopping_cart_count', 'tags_mask',
+        )
+        for ids in self.batches(start, start + count):
+            tags = {pk: self.choose_tags() for pk in ids}
+            recipes = [
+                self.recipe_row(
+                    pk, self.datetime(first_date + step * (pk - start)),
+                    image, tags[pk],
+                )
+                for pk in ids
+            ]
+            self.recipe_authors.extend(row[1] for row in recipes)
+            with transaction.atomic():
+                insert_rows(Recipe, fields, recipes)
+                insert_rows(
+                    IngredientsInRecipe, ('recipe', 'ingredient', 'amount'),
+                    (row for pk in ids for row in self.ingredient_rows(pk))
+                )
+                insert_rows(
+                    TagsRecipe, ('recipe', 'tag'),
+                    ((pk, tag) for pk in ids for tag in tags[pk])
+                )
+            self.report(f'{ids[-1] - start + 1} of {count} recipes')
+        return range(start, start + count)
+
+    def create_relations(self, model, fields, users, targets, average,
+                         skip=None):
+        """
+        Связи пользователей с targets, в среднем average на пользователя.
+
+        Число связей у пользователя распределено экспоненциально,
+        пары, для которых skip(user, target), пропускаются.
+        """
+        total = 0
+        for first in range(0, len(users), self.batch_size):
+            rows = []
+            for user in users[first:first + self.batch_size]:
+                count = (
+                    int(self.rng.expovariate(1 / average)) if average else 0
+                )
+                user_skip = None
+                if skip is not None:
+                    user_skip = partial(skip, user)
+                rows.extend(
+                    (user, target)
+                    for target in targets.sample(count, skip=user_skip)
+                )
+            with transaction.atomic():
+                insert_rows(model, fields, rows)
+            total += len(rows)
+        self.report(f'{total} {model._meta.verbose_name_plural}')
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipe])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def update_derived(self):
+        """Данные, которые при обычной записи поддерживают сигналы."""
+        for model, field, related_model, related_field in COUNTERS:
+            reconcile(
+                apps.get_model(model), field,
+                apps.get_model(related_model), related_field,
+                batch_size=self.batch_size,
+            )
+        self.report('Counters reconciled')
+        rebuild(IngredientsInShoppingList, IngredientsInRecipe)
+        self.report('Shopping list ingredient totals rebuilt')
+        search.update_index()
+        self.report('Search index updated')
+        cache.bump_version()
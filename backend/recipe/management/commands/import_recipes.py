@@ -0,0 +1,244 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+from recipe.images import delete_variants, prepare_image, save_variants
+from recipe.models import Ingredients, Recipe, Tags
+from recipe.serializers import RecipeCreateSerializer
+from users.models import User
+
+
+class RecipeImportSerializer(RecipeCreateSerializer):
+    """
+    RecipeCreateSerializer для импорта: фото проверяется и уменьшается
+    в пуле процессов и передаётся в save() уже готовым. Уменьшенные
+    копии команда записывает после фиксации пачки, см. import_batch.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['image'].required = False
+        # Автора передаёт команда, запроса с пользователем нет.
+        del self.fields['author']
+        self.variants = None
+
+    def save_image_variants(self, recipe):
+        """Копии фото не пишутся в хранилище до фиксации транзакции."""
+
+
+class Command(BaseCommand):
+    """
+    Импортирует рецепты из JSON Lines.
+
+    Строка - объект с полями author (username), name, text,
+    cooking_time, tags (слаги), ingredients ({id, amount} или
+    {name, measurement_unit, amount}) и image (data:...;base64,...
+    или путь к файлу относительно файла импорта).
+    """
+    help = 'Import recipes from a JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSON Lines file.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Image processing processes.',
+        )
+        parser.add_argument(
+            '--state',
+            help='Progress file for resuming (default: <path>.state).',
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore saved progress and start from the first line.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.batch_size = options['batch_size']
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.state_path = options['state'] or f'{path}.state'
+        self.state = {'offset': 0, 'line': 0, 'imported': 0, 'failed': 0}
+        if not options['restart'] and os.path.exists(self.state_path):
+            with open(self.state_path) as file:
+                self.state = json.load(file)
+            self.stdout.write(f'Resuming after line {self.state["line"]}.')
+        self.authors = {}
+        self.tags = dict(Tags.objects.values_list('slug', 'id'))
+        self.ingredients = {
+            (name, unit): id for id, name, unit in
+            Ingredients.objects.values_list(
+                'id', 'name', 'measurement_unit').iterator()
+        }
+        self.started = time.perf_counter()
+        self.imported = 0
+        try:
+            file = open(path, 'rb')
+        except OSError as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        with file, ProcessPoolExecutor(options['workers']) as pool:
+            file.seek(self.state['offset'])
+            self.line = self.state['line']
+            batch = self.read_batch(file, pool)
+            while batch[0]:
+                # Фото следующей пачки готовятся, пока пишется текущая.
+                upcoming = self.read_batch(file, pool)
+                self.import_batch(*batch)
+                batch = upcoming
+        self.report('Done')
+
+    def read_batch(self, file, pool):
+        """
+        Читает до batch_size строк и ставит их фото в очередь.
+
+        Возвращает (строки, номер последней строки, смещение после неё).
+        """
+        batch = []
+        while len(batch) < self.batch_size:
+            line = file.readline()
+            if not line:
+                break
+            self.line += 1
+            if not line.strip():
+                continue
+            try:
+                document = json.loads(line)
+                if not isinstance(document['image'], str):
+                    raise TypeError('Поле image должно быть строкой.')
+                image = pool.submit(
+                    prepare_image, document['image'],
+                    settings.RECIPE_IMAGE_MAX_SIZE,
+                    settings.RECIPE_IMAGE_MAX_PIXELS,
+                    self.base_dir,
+                )
+            except (ValueError, KeyError, TypeError) as error:
+                document, image = error, None
+            batch.append((self.line, document, image))
+        return batch, self.line, file.tell()
+
+    def get_author(self, username):
+        if username not in self.authors:
+            self.authors[username] = User.objects.filter(
+                username=username).first()
+        return self.authors[username]
+
+    def get_data(self, document):
+        """Данные для сериализатора: слаги и названия заменяются на id."""
+        unknown = [
+            slug for slug in document.get('tags', [])
+            if slug not in self.tags
+        ]
+        ingredients = []
+        for item in document.get('ingredients', []):
+            if 'id' not in item:
+                key = (item.get('name'), item.get('measurement_unit'))
+                if key not in self.ingredients:
+                    unknown.append(' '.join(map(str, key)))
+                    continue
+                item = {'id': self.ingredients[key], 'amount': item.get(
+                    'amount')}
+            ingredients.append(item)
+        if unknown:
+            raise ValueError(f'Не найдены: {", ".join(unknown)}.')
+        return {
+            'name': document.get('name'),
+            'text': document.get('text'),
+            'cooking_time': document.get('cooking_time'),
+            'tags': [self.tags[slug] for slug in document.get('tags', [])],
+            'ingredients': ingredients,
+        }
+
+    def prepare(self, line, document, image):
+        """Возвращает сериализатор, готовый к save(), или None."""
+        try:
+            if isinstance(document, Exception):
+                raise document
+            author = self.get_author(document.get('author'))
+            if author is None:
+                raise ValueError(
+                    f'Автор {document.get("author")!r} не найден.')
+            serializer = RecipeImportSerializer(data=self.get_data(document))
+            if not serializer.is_valid():
+                raise ValueError(
+                    json.dumps(serializer.errors, ensure_ascii=False))
+            try:
+                extension, content, serializer.variants = image.result()
+            except (ValueError, OSError):
+                raise
+            except Exception as error:
+                # Из процесса пула приходит любое исключение Pillow
+                # или самого пула, это ошибка строки, а не импорта.
+                raise ValueError(repr(error)) from error
+        except (ValueError, KeyError, TypeError, OSError) as error:
+            if image is not None:
+                image.cancel()
+            self.state['failed'] += 1
+            self.stderr.write(f'Line {line}: {error}')
+            return None
+        return line, serializer, author, ContentFile(
+            content, name=f'{uuid4()}.{extension}')
+
+    def save_recipe(self, line, serializer, author, image):
+        """
+        Сохраняет рецепт в своей точке сохранения и возвращает его;
+        ошибка БД или хранилища - ошибка строки, а не пачки.
+        """
+        try:
+            with transaction.atomic():
+                return serializer.save(author=author, image=image)
+        except (DatabaseError, OSError) as error:
+            # Фото записывается в хранилище до INSERT, имя уникально.
+            field = Recipe._meta.get_field('image')
+            field.storage.delete(field.generate_filename(None, image.name))
+            self.state['failed'] += 1
+            self.stderr.write(f'Line {line}: {error}')
+            return None
+
+    def save_variants(self, line, recipe, variants):
+        try:
+            save_variants(recipe, variants)
+        except (DatabaseError, OSError) as error:
+            delete_variants(recipe)
+            self.stderr.write(
+                f'Line {line}: imported without resized photos: {error}')
+
+    def import_batch(self, batch, line, offset):
+        prepared = [
+            item for item in (self.prepare(*item) for item in batch)
+            if item is not None
+        ]
+        with transaction.atomic():
+            recipes = [
+                (item[0], item[1].variants, self.save_recipe(*item))
+                for item in prepared
+            ]
+        recipes = [item for item in recipes if item[2] is not None]
+        for item_line, variants, recipe in recipes:
+            self.save_variants(item_line, recipe, variants)
+        self.imported += len(recipes)
+        self.state['imported'] += len(recipes)
+        self.state['line'] = line
+        self.state['offset'] = offset
+        self.save_state()
+        self.report(f'Line {self.state["line"]}')
+
+    def save_state(self):
+        temporary = f'{self.state_path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.state, file)
+        os.replace(temporary, self.state_path)
+
+    def report(self, prefix):
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(
+            f'{prefix}: {self.state["imported"]} imported, '
+            f'{self.state["failed"]} failed, '
+            f'{self.imported / elapsed if elapsed else 0:.1f} recipes/s.'
+        )
@@ -1,19 +1,20 @@
-from csv import reader
-from django.core.management.base import BaseCommand
+import os
+
+from recipe.loaders import DATA_DIR, BaseCatalogCommand
 from recipe.models import Ingredients
+from recipe.signals import bump_ingredients_version
+
 
+class Command(BaseCatalogCommand):
+    """Загружает ингредиенты из CSV или JSON."""
+    help = 'Load ingredients data from a csv or json file to DB.'
 
-class Command(BaseCommand):
-    """Создает записи в модели Ingredients из списка."""
-    help = 'Load ingredients data from csv-file to DB.'
+    model = Ingredients
+    fields = ('name', 'measurement_unit')
+    key_fields = ('name', 'measurement_unit')
+    default_path = os.path.join(DATA_DIR, 'ingredients.csv')
 
-    def handle(self, *args, **kwargs):
-        with open(
-                'recipe/data/ingredients.csv', 'r',
-                encoding='UTF-8'
-        ) as ingredients:
-            for row in reader(ingredients):
-                if len(row) == 2:
-                    Ingredients.objects.get_or_create(
-                        name=row[0], measurement_unit=row[1],
-                    )
+    def changed(self, created, changed):
+        # Все поля ингредиента входят в ключ, меняются только новые.
+        if created:
+            bump_ingredients_version()
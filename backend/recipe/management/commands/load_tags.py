@@ -1,21 +1,33 @@
-from csv import reader
+import os
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
 
+from recipe.loaders import DATA_DIR, BaseCatalogCommand
 from recipe.models import Tags
+from recipe.tag_masks import MAX_TAGS, assign_bits, free_bits
+from recipe.signals import bump_cache_version, bump_tags_version
 
 
-class Command(BaseCommand):
-    """Создает записи в модели Tag из списка."""
-    help = 'Load tags data from csv-file to DB.'
+class Command(BaseCatalogCommand):
+    """Загружает теги из CSV или JSON."""
+    help = 'Load tags data from a csv or json file to DB.'
 
-    def handle(self, *args, **kwargs):
-        with open(
-                'recipe/data/recipe_tag.csv', 'r',
-                encoding='UTF-8'
-        ) as tags:
-            for row in reader(tags):
-                if len(row) == 3:
-                    Tags.objects.get_or_create(
-                        name=row[0], color=row[1], slug=row[2],
-                    )
+    model = Tags
+    fields = ('name', 'color', 'slug')
+    key_fields = ('slug',)
+    default_path = os.path.join(DATA_DIR, 'recipe_tag.csv')
+
+    def validate(self, new):
+        free = len(list(free_bits()))
+        if len(new) > free:
+            raise CommandError(
+                f'{len(new)} new tags, but only {free} more fit '
+                f'in the tag mask ({MAX_TAGS} tags at most).')
+
+    def changed(self, created, changed):
+        if created:
+            assign_bits()
+        if changed:
+            bump_cache_version()
+        if created or changed:
+            bump_tags_version()
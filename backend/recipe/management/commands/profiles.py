@@ -0,0 +1,77 @@
+import json
+import os
+import pstats
+from io import StringIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram.profiling import profile_names
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class Command(BaseCommand):
+    """
+    Список профилей запросов или сводка по одному из них.
+
+    Без аргументов выводит сохранённые профили, с именем (или его
+    началом) - самые затратные функции и отчёт о памяти.
+    """
+    help = 'List captured request profiles or summarize one of them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'name', nargs='?', help='Profile name or its unique prefix.')
+        parser.add_argument('--limit', type=int, default=30)
+        parser.add_argument('--sort', choices=SORT_KEYS, default=SORT_KEYS[0])
+        parser.add_argument(
+            '--url-name', help='Only list profiles of this URL name.')
+
+    def handle(self, *args, **options):
+        self.directory = settings.PROFILING_DIR
+        names = profile_names(self.directory)
+        if options['name'] is None:
+            self.list(names, options['url_name'])
+            return
+        matches = [
+            name for name in names if name.startswith(options['name'])]
+        if len(matches) != 1:
+            raise CommandError(
+                f'{len(matches)} profiles match "{options["name"]}".')
+        self.summarize(matches[0], options['sort'], options['limit'])
+
+    def read_meta(self, name):
+        with open(os.path.join(self.directory, f'{name}.json')) as file:
+            return json.load(file)
+
+    def list(self, names, url_name):
+        if not names:
+            self.stdout.write(f'No profiles in {self.directory}.')
+            return
+        for name in reversed(names):
+            meta = self.read_meta(name)
+            if url_name and meta['url_name'] != url_name:
+                continue
+            self.stdout.write(
+                f'{name}  {meta["status"]}  {meta["duration_ms"]:>9.1f} ms'
+                f'{"  memory" if meta["memory"] else ""}  '
+                f'{meta["method"]} {meta["path"]}'
+            )
+
+    def summarize(self, name, sort, limit):
+        meta = self.read_meta(name)
+        self.stdout.write(
+            f'{meta["method"]} {meta["path"]} ({meta["url_name"]}): '
+            f'{meta["status"]}, {meta["duration_ms"]} ms\n'
+        )
+        path = os.path.join(self.directory, name)
+        # OutputWrapper дописывает перевод строки к каждому write().
+        buffer = StringIO()
+        stats = pstats.Stats(f'{path}.prof', stream=buffer)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        self.stdout.write(buffer.getvalue())
+        if meta['memory'] and os.path.exists(f'{path}.mem.txt'):
+            with open(f'{path}.mem.txt') as file:
+                self.stdout.write('Top allocations:\n')
+                self.stdout.write(file.read())
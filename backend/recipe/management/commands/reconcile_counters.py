@@ -0,0 +1,34 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from recipe.cart_totals import rebuild
+from recipe.counters import COUNTERS, reconcile
+from recipe.models import IngredientsInRecipe, IngredientsInShoppingList
+
+
+class Command(BaseCommand):
+    """Сверяет денормализованные счётчики с фактическими данными."""
+    help = ('Recalculate drifted favorites/cart/recipes/followers counters '
+            'and rebuild shopping list ingredient totals.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report drifted counters.',
+        )
+
+    def handle(self, *args, batch_size, dry_run, **kwargs):
+        for model, field, related_model, related_field in COUNTERS:
+            model = apps.get_model(model)
+            drifted = reconcile(
+                model, field, apps.get_model(related_model), related_field,
+                batch_size=batch_size, dry_run=dry_run,
+            )
+            self.stdout.write(
+                f'{model._meta.label}.{field}: {drifted} drifted'
+                + ('' if dry_run or not drifted else ', fixed')
+            )
+        if not dry_run:
+            rebuild(IngredientsInShoppingList, IngredientsInRecipe)
+            self.stdout.write('Shopping list ingredient totals rebuilt')
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.19 on 2026-10-18 11:00
+
+from django.db import migrations
+
+from recipe import search
+
+
+def install_search_index(apps, schema_editor):
+    search.install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0004_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
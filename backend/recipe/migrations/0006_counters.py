@@ -0,0 +1,34 @@
+# Generated by Django 3.2.19 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+from recipe.counters import reconcile
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    reconcile(Recipe, 'favorites_count',
+              apps.get_model('recipe', 'FavoriteRecipe'), 'recipe')
+    reconcile(Recipe, 'shopping_cart_count',
+              apps.get_model('recipe', 'ShoppingList'), 'recipe')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0005_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
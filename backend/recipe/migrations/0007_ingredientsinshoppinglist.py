@@ -0,0 +1,43 @@
+# Generated by Django 3.2.19 on 2026-10-18 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from recipe.cart_totals import rebuild
+
+
+def fill_totals(apps, schema_editor):
+    rebuild(
+        apps.get_model('recipe', 'IngredientsInShoppingList'),
+        apps.get_model('recipe', 'IngredientsInRecipe'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipe', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientsInShoppingList',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_totals', to='recipe.ingredients', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в списке покупок',
+                'verbose_name_plural': 'Ингредиенты в списках покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientsinshoppinglist',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_ingredient'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
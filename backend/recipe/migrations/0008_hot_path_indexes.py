@@ -0,0 +1,29 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_ingredientsinshoppinglist'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favoriterecipe',
+            index=models.Index(fields=['user', 'recipe'], name='favorite_user_recipe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagsrecipe',
+            index=models.Index(fields=['tag', 'recipe'], name='tagsrecipe_tag_recipe_idx'),
+        ),
+    ]
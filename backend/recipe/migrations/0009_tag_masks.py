@@ -0,0 +1,31 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+from recipe.tag_masks import assign_bits, rebuild
+
+
+def fill_masks(apps, schema_editor):
+    assign_bits(apps.get_model('recipe', 'Tags'))
+    rebuild(using=schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.AddField(
+            model_name='tags',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, verbose_name='Бит в маске тегов'),
+        ),
+        migrations.RunPython(fill_masks, migrations.RunPython.noop),
+    ]
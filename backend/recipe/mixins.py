@@ -0,0 +1,133 @@
+from hashlib import md5
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+
+from .cache import cached_response, get_version
+from .snapshots import get_snapshot, snapshot_response
+
+
+class CachedResponseMixin:
+    """Кэширует list/retrieve, см. recipe.cache."""
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(
+            request, 'list',
+            lambda: super(CachedResponseMixin, self).list(
+                request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(
+            request, 'retrieve',
+            lambda: super(CachedResponseMixin, self).retrieve(
+                request, *args, **kwargs)
+        )
+
+
+class ConditionalGetMixin:
+    """
+    Поддержка ETag / Last-Modified для list и retrieve.
+
+    Если get_conditional_validators() возвращает состояние ресурса
+    (обычно агрегат по колонке updated), оно проверяется до построения
+    ответа, и на 304 сериализации нет. Если состояния нет, ETag
+    строится после ответа: по поколениям кэша conditional_version_keys
+    и отданным данным (get_served_state()). Так проверка ответа,
+    взятого из кэша, не добавляет запросов к БД, но тело строится
+    и на 304 - это запасной путь для списков.
+    """
+
+    conditional_version_keys = ()
+
+    def get_conditional_validators(self):
+        """Возвращает (state, last_modified) для текущего запроса."""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            try:
+                updated = queryset.filter(
+                    **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+                ).values_list('updated', flat=True).first()
+            except (TypeError, ValueError):
+                return None, None
+            return updated, updated
+        # Аннотации queryset не нужны для агрегата.
+        state = queryset.values('id').aggregate(
+            count=Count('id'), updated=Max('updated')
+        )
+        return state, None
+
+    def get_served_state(self, data):
+        """Часть отданных данных, от которой зависит ETag."""
+        return data
+
+    def make_etag(self, request, state):
+        return '"{}"'.format(md5(
+            f'{request.get_full_path()}:{state}'.encode()
+        ).hexdigest())
+
+    def conditional_response(self, request, get_response):
+        state, last_modified = self.get_conditional_validators()
+        if state is None:
+            return self.served_conditional_response(request, get_response)
+        etag = self.make_etag(request, state)
+        if last_modified is not None:
+            last_modified = int(last_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = get_response()
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def served_conditional_response(self, request, get_response):
+        response = get_response()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        versions = [get_version(key) for key in self.conditional_version_keys]
+        etag = self.make_etag(
+            request, (versions, self.get_served_state(response.data)))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            response = not_modified
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            lambda: super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            lambda: super(ConditionalGetMixin, self).retrieve(
+                request, *args, **kwargs)
+        )
+
+
+class SnapshotListMixin:
+    """
+    Отдаёт полный список без фильтров из снимка, см. recipe.snapshots.
+
+    snapshot_version_key - ключ поколения справочника в кэше.
+    """
+
+    snapshot_version_key = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        snapshot = get_snapshot(
+            self.snapshot_version_key,
+            lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+        return snapshot_response(request, snapshot)
@@ -14,6 +14,8 @@ class Ingredients(models.Model):
     measurement_unit = models.CharField(max_length=25,
                                         verbose_name='Единицы измерения',
                                         blank=False)
+    updated = models.DateTimeField(auto_now=True,
+                                   verbose_name='Дата изменения')
 
     class Meta:
         constraints = models.UniqueConstraint(
@@ -41,6 +43,12 @@ class Tags(models.Model):
     slug = models.SlugField(unique=True,
                             blank=False,
                             verbose_name='Слаг/Slug')
+    bit = models.PositiveSmallIntegerField(unique=True,
+                                           null=True,
+                                           editable=False,
+                                           verbose_name='Бит в маске тегов')
+    updated = models.DateTimeField(auto_now=True,
+                                   verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'тег'
@@ -60,6 +68,10 @@ class Recipe(models.Model):
                             verbose_name='Название')
     image = models.ImageField(verbose_name='Фото блюда',
                               upload_to='recipe/')
+    image_variants = models.JSONField(default=dict,
+                                      blank=True,
+                                      editable=False,
+                                      verbose_name='Варианты фото')
     text = models.TextField(verbose_name='Описание')
     ingredients = models.ManyToManyField(Ingredients,
                                          through='IngredientsInRecipe',
@@ -78,8 +90,33 @@ class Recipe(models.Model):
     )
     pub_date = models.DateTimeField(auto_now_add=True,
                                     verbose_name='Дата публикации')
+    updated = models.DateTimeField(auto_now=True,
+                                   verbose_name='Дата изменения')
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+    tags_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Маска тегов'
+    )
 
     class Meta:
+        # Лента по дате и рецепты автора (фильтр author, подписки)
+        # с порядком курсорной пагинации.
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_idx'),
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe_author_pub_date_idx'),
+        )
         verbose_name = 'рецепт'
         verbose_name_plural = 'рецепты'
         ordering = ('-pub_date',)
@@ -91,6 +128,13 @@ class TagsRecipe(models.Model):
     tag = models.ForeignKey(Tags, on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
 
+    class Meta:
+        # Фильтр рецептов по тегам.
+        indexes = (
+            models.Index(fields=('tag', 'recipe'),
+                         name='tagsrecipe_tag_recipe_idx'),
+        )
+
 
 class FavoriteRecipe(models.Model):
     """Модель избранных рецептов."""
@@ -109,6 +153,11 @@ class FavoriteRecipe(models.Model):
             fields=['recipe', 'user'],
             name='unique_favorite_recipe',
         ),
+        # Избранное пользователя; уникальный индекс начинается с recipe.
+        indexes = (
+            models.Index(fields=('user', 'recipe'),
+                         name='favorite_user_recipe_idx'),
+        )
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
         ordering = ('-id',)
@@ -173,3 +222,34 @@ class IngredientsInRecipe(models.Model):
 
     def __str__(self):
         return f'{self.recipe}: {self.ingredient} – {self.amount}'
+
+
+class IngredientsInShoppingList(models.Model):
+    """
+    Суммарное количество ингредиента в списке покупок пользователя.
+
+    Поддерживается приращениями, см. recipe.cart_totals.
+    """
+
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='shopping_list_ingredients',
+                             verbose_name='Пользователь')
+    ingredient = models.ForeignKey(Ingredients,
+                                   on_delete=models.CASCADE,
+                                   related_name='shopping_list_totals',
+                                   verbose_name='Ингредиент')
+    amount = models.DecimalField(max_digits=12,
+                                 decimal_places=2,
+                                 verbose_name='Количество')
+
+    class Meta:
+        constraints = (models.UniqueConstraint(
+            fields=('user', 'ingredient'),
+            name='unique_shopping_list_ingredient'
+        )),
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} – {self.amount}'
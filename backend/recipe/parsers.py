@@ -0,0 +1,32 @@
+from io import BytesIO
+
+from django.conf import settings
+from rest_framework import exceptions, status
+from rest_framework.parsers import JSONParser
+
+
+class RequestTooLarge(exceptions.APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой запрос.'
+    default_code = 'request_too_large'
+
+
+class BoundedJSONParser(JSONParser):
+    """
+    JSONParser, отклоняющий тело больше RECIPE_JSON_MAX_SIZE.
+
+    Content-Length проверяется сразу, но ему не верим: тело читается
+    не больше чем на лимит плюс байт, так что в памяти не бывает
+    больше RECIPE_JSON_MAX_SIZE и без заголовка. Раньше приложения
+    большие тела отсекает nginx (client_max_body_size в infra).
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        limit = settings.RECIPE_JSON_MAX_SIZE
+        request = parser_context['request']
+        if int(request.META.get('CONTENT_LENGTH') or 0) > limit:
+            raise RequestTooLarge()
+        body = stream.read(limit + 1)
+        if len(body) > limit:
+            raise RequestTooLarge()
+        return super().parse(BytesIO(body), media_type, parser_context)
@@ -0,0 +1,40 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Формат выгрузки списка покупок для ?format= и Accept.
+
+    Сам файл строит recipe.shopping_list, через рендерер проходят
+    только ошибки, они отдаются в JSON.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return JSONRenderer().render(data)
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListPDFRenderer,
+)
@@ -0,0 +1,177 @@
+"""
+Полнотекстовый поиск рецептов по названию, ингредиентам и описанию.
+
+PostgreSQL: колонка recipe_recipe.search_vector (tsvector, русская
+морфология) с GIN-индексом. SQLite: shadow-таблица FTS5
+recipe_recipe_fts с rowid = id рецепта. Индекс обновляется
+приложением после фиксации транзакции, см. recipe.signals.
+На прочих СУБД поиск выполняется через icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .deferred import Deferred
+
+FTS_TABLE = 'recipe_recipe_fts'
+SEARCH_CONFIG = 'russian'
+
+POSTGRESQL_INSTALL = (
+    'ALTER TABLE recipe_recipe ADD COLUMN search_vector tsvector',
+    'CREATE INDEX recipe_recipe_search_vector_gin '
+    'ON recipe_recipe USING gin (search_vector)',
+)
+POSTGRESQL_UNINSTALL = (
+    'ALTER TABLE recipe_recipe DROP COLUMN search_vector',
+)
+POSTGRESQL_UPDATE = f"""
+    UPDATE recipe_recipe AS r SET search_vector =
+        setweight(to_tsvector('{SEARCH_CONFIG}', r.name), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce((
+            SELECT string_agg(i.name, ' ')
+            FROM recipe_ingredientsinrecipe AS ri
+            JOIN recipe_ingredients AS i ON i.id = ri.ingredient_id
+            WHERE ri.recipe_id = r.id
+        ), '')), 'B')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', r.text), 'C')
+"""
+POSTGRESQL_QUERY = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+
+SQLITE_INSTALL = (
+    f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+    "name, ingredients, text, tokenize = 'unicode61 remove_diacritics 2')",
+)
+SQLITE_UNINSTALL = (f'DROP TABLE {FTS_TABLE}',)
+SQLITE_INSERT = f"""
+    INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text)
+    SELECT r.id, r.name, coalesce((
+        SELECT group_concat(i.name, ' ')
+        FROM recipe_ingredientsinrecipe AS ri
+        JOIN recipe_ingredients AS i ON i.id = ri.ingredient_id
+        WHERE ri.recipe_id = r.id
+    ), ''), r.text
+    FROM recipe_recipe AS r
+"""
+# Веса столбцов name, ingredients, text для bm25.
+SQLITE_RANK = f'bm25({FTS_TABLE}, 10.0, 4.0, 1.0)'
+
+
+def _execute(statements, using):
+    with using.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def install(using=connection):
+    """Создаёт колонку или таблицу индекса и заполняет её."""
+    if using.vendor == 'postgresql':
+        _execute(POSTGRESQL_INSTALL, using)
+    elif using.vendor == 'sqlite':
+        _execute(SQLITE_INSTALL, using)
+    update_index(using=using)
+
+
+def uninstall(using=connection):
+    if using.vendor == 'postgresql':
+        _execute(POSTGRESQL_UNINSTALL, using)
+    elif using.vendor == 'sqlite':
+        _execute(SQLITE_UNINSTALL, using)
+
+
+def update_index(recipe_ids=None, using=connection):
+    """Переиндексирует рецепты recipe_ids (None - все рецепты)."""
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+    with using.cursor() as cursor:
+        if using.vendor == 'postgresql':
+            if recipe_ids is None:
+                cursor.execute(POSTGRESQL_UPDATE)
+            else:
+                cursor.execute(
+                    POSTGRESQL_UPDATE + ' WHERE r.id = ANY(%s)', [recipe_ids]
+                )
+        elif using.vendor == 'sqlite':
+            if recipe_ids is None:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+                cursor.execute(SQLITE_INSERT)
+                return
+            placeholders = ', '.join(['%s'] * len(recipe_ids))
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+                recipe_ids
+            )
+            cursor.execute(
+                SQLITE_INSERT + f' WHERE r.id IN ({placeholders})',
+                recipe_ids
+            )
+
+
+def reindex(recipe_ids, using):
+    update_index(recipe_ids, using=using)
+
+
+# Каждый рецепт переиндексируется один раз за транзакцию.
+pending_updates = Deferred(reindex)
+
+
+def schedule_update(recipe_ids, using=connection):
+    """Переиндексирует рецепты после фиксации текущей транзакции."""
+    recipe_ids = set(recipe_ids)
+    if recipe_ids:
+        pending_updates.add(recipe_ids, using=using.alias)
+
+
+def remove_from_index(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if connection.vendor != 'sqlite' or not recipe_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+            recipe_ids
+        )
+
+
+def fts_query(value):
+    """Запрос FTS5: все слова как префиксы, вместо морфологии."""
+    words = re.findall(r'\w+', value)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search(queryset, value):
+    """
+    Оставляет рецепты, подходящие под запрос value.
+
+    Добавляет аннотацию search_rank и сортирует по ней.
+    """
+    if connection.vendor == 'postgresql':
+        return queryset.filter(pk__in=RawSQL(
+            'SELECT id FROM recipe_recipe '
+            f'WHERE search_vector @@ {POSTGRESQL_QUERY}', [value]
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank(recipe_recipe.search_vector, {POSTGRESQL_QUERY})',
+            [value], output_field=FloatField()
+        )).order_by('-search_rank', '-pub_date')
+    if connection.vendor == 'sqlite':
+        query = fts_query(value)
+        if not query:
+            return queryset
+        # bm25 тем меньше, чем лучше совпадение.
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [query]
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -{SQLITE_RANK} FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = recipe_recipe.id',
+            [query], output_field=FloatField()
+        )).order_by('-search_rank', '-pub_date')
+    return queryset.filter(
+        Q(name__icontains=value)
+        | Q(text__icontains=value)
+        | Q(ingredients__name__icontains=value)
+    ).distinct()
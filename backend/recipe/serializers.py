@@ -1,39 +1,149 @@
-from django.shortcuts import get_object_or_404
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.fields import SkipField
 from rest_framework.validators import UniqueTogetherValidator
+from foodgram import metrics
+from foodgram.timing import TimedSerializerMixin, measure
 from .models import (Ingredients,
                      Tags,
                      IngredientsInRecipe,
+                     IngredientsInShoppingList,
                      Recipe,
                      FavoriteRecipe,
                      ShoppingList,
                      TagsRecipe)
-from drf_base64.fields import Base64ImageField
 from users.models import User
+from . import cart_totals, search, tag_masks
+from users.subscriptions import IsSubscribedField
+from .images import (VARIANTS,
+                     ImageTooLarge,
+                     decode_base64,
+                     image_pixels,
+                     save_variants)
+
+# Варианты изображения по умолчанию, первый из них отдаётся в поле image.
+DEFAULT_IMAGE_VARIANTS = ('detail', 'card', 'original')
+
+
+def image_url(storage, name, request=None):
+    url = storage.url(name)
+    return request.build_absolute_uri(url) if request else url
+
+
+class RecipeImageField(serializers.Field):
+    """URL изображения рецепта (JPEG-вариант или оригинал)."""
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        variant = self.variant or self.context.get(
+            'image_variants', DEFAULT_IMAGE_VARIANTS)[0]
+        name = recipe.image_variants.get(variant, {}).get(
+            'jpeg', recipe.image.name)
+        return image_url(
+            recipe.image.storage, name, self.context.get('request'))
+
+
+class Base64ImageUploadField(serializers.ImageField):
+    """
+    Изображение строкой data:image/...;base64,... или файлом multipart.
+
+    base64 декодируется по частям во временный файл, так что в памяти
+    нет второй, декодированной копии. Сама строка к этому моменту уже
+    в памяти целиком: её размер ограничивает BoundedJSONParser.
+    Размер и число пикселей (по заголовку) проверяются до полного
+    декодирования.
+    """
+
+    default_error_messages = {
+        'invalid_base64': 'Некорректное изображение в формате base64.',
+        'too_large': 'Размер изображения больше {max_size} байт.',
+        'too_many_pixels': 'Изображение больше {max_pixels} пикселей.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data.startswith('http'):
+            raise SkipField()
+        with measure('image'):
+            return self.parse_image(data)
+
+    def parse_image(self, data):
+        if isinstance(data, str):
+            data = self.decode(data)
+        metrics.observe(
+            'foodgram_image_upload_bytes', metrics.IMAGE_BUCKETS,
+            getattr(data, 'size', 0) or 0,
+        )
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if getattr(data, 'size', 0) > max_size:
+            self.fail('too_large', max_size=max_size)
+        max_pixels = settings.RECIPE_IMAGE_MAX_PIXELS
+        if hasattr(data, 'seek') and (image_pixels(data) or 0) > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+        return super().to_internal_value(data)
+
+    def decode(self, data):
+        header, separator, payload = data.partition(';base64,')
+        if not header.startswith('data:') or not separator:
+            self.fail('invalid_base64')
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        # Длина base64 сразу даёт оценку размера файла.
+        if len(payload) // 4 * 3 > max_size:
+            self.fail('too_large', max_size=max_size)
+        content_type = header[len('data:'):]
+        extension = content_type.split('/')[-1]
+        file = TemporaryUploadedFile(
+            f'{uuid4()}.{extension}', content_type, 0, None
+        )
+        try:
+            file.size = decode_base64(payload, file, max_size)
+        except ImageTooLarge:
+            file.close()
+            self.fail('too_large', max_size=max_size)
+        except ValueError:
+            file.close()
+            self.fail('invalid_base64')
+        file.seek(0)
+        return file
 
 
 class AuthorSerializer(serializers.ModelSerializer):
     """Сериализатор для авторов."""
 
+    is_subscribed = IsSubscribedField()
+
     class Meta:
         model = User
-        fields = ('email', 'id', 'username', 'first_name', 'last_name',)
+        fields = ('email', 'id', 'username', 'first_name', 'last_name',
+                  'is_subscribed',)
 
 
-class IngredientsSerializer(serializers.ModelSerializer):
+class IngredientsSerializer(TimedSerializerMixin,
+                            serializers.ModelSerializer):
     """"Сериализатор для модели ингредиентов."""
 
     class Meta:
         model = Ingredients
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit',)
 
 
-class TagsSerializer(serializers.ModelSerializer):
+class TagsSerializer(TimedSerializerMixin,
+                     serializers.ModelSerializer):
     """Сериализатор для модели тегов."""
 
     class Meta:
         model = Tags
-        fields = '__all__'
+        fields = ('id', 'name', 'color', 'slug',)
 
 
 class ShowIngredientsInRecipeSerializer(serializers.ModelSerializer):
@@ -50,6 +160,30 @@ class ShowIngredientsInRecipeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class ShoppingListIngredientsSerializer(TimedSerializerMixin,
+                                        serializers.ModelSerializer):
+    """Сериализатор для сумм ингредиентов в списке покупок."""
+
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = IngredientsInShoppingList
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+def merge_ingredients(ingredient_list):
+    """Суммирует количества повторяющихся ингредиентов: {id: amount}."""
+    ingredients = {}
+    for item in ingredient_list:
+        ingredients[item['id']] = (
+            ingredients.get(item['id'], 0) + item['amount']
+        )
+    return ingredients
+
+
 class IngredientRecipeSaveSerializer(serializers.Serializer):
     """Сериализатор для сохранения ингредиентов в рецепте."""
 
@@ -57,8 +191,15 @@ class IngredientRecipeSaveSerializer(serializers.Serializer):
     amount = serializers.IntegerField(min_value=1)
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания рецепта."""
+class RecipeCreateSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
+    """
+    Сериализатор для создания рецепта.
+
+    Принимает JSON или multipart: в multipart теги передаются
+    повторяющимся полем tags, ингредиенты - полями ingredients[0]id,
+    ingredients[0]amount и т.д., изображение - файлом image.
+    """
 
     tags = serializers.PrimaryKeyRelatedField(
         many=True, queryset=Tags.objects.all()
@@ -68,7 +209,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         read_only=True
     )
     ingredients = IngredientRecipeSaveSerializer(many=True)
-    image = Base64ImageField()
+    image = Base64ImageUploadField()
 
     class Meta:
         model = Recipe
@@ -76,89 +217,158 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ('author', 'ingredients',)
 
     def to_representation(self, value):
+        prefetch_related_objects(
+            [value],
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=IngredientsInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
         data = RecipeSerializer(value, context={'request': self.context.get(
             'request')}).data
         return data
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            # Временный файл декодированного изображения уже сохранён
+            # в хранилище, закрываем его сразу, не дожидаясь сборщика.
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
+    def validate_ingredients(self, value):
+        """Проверяет все ингредиенты одним запросом."""
+        ids = {item['id'] for item in value}
+        existing = set(Ingredients.objects.filter(
+            id__in=ids
+        ).values_list('id', flat=True))
+        missing = ids - existing
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: {}.'.format(
+                    ', '.join(map(str, sorted(missing))))
+            )
+        return value
+
     def create(self, validated_data):
         tags_list = validated_data.pop('tags')
-        ingredient_list = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data)
-        existing_ingredients = {}
-
-        for item in ingredient_list:
-            ingredient = get_object_or_404(Ingredients, id=item.get('id'))
-            amount = item['amount']
-
-            if ingredient.id in existing_ingredients:
-                amount_ex = existing_ingredients[ingredient.id]
-                IngredientsInRecipe.objects.filter(
-                    ingredient=ingredient,
-                    recipe=recipe,
-                    amount=amount_ex
-                ).delete()
-
-                IngredientsInRecipe.objects.create(
-                    ingredient=ingredient,
-                    recipe=recipe,
-                    amount=amount + amount_ex
-                )
-                existing_ingredients[ingredient.id] = amount
-            else:
-
-                IngredientsInRecipe.objects.create(
-                    ingredient=ingredient,
-                    recipe=recipe,
-                    amount=amount
+        ingredients = merge_ingredients(validated_data.pop('ingredients'))
+        with transaction.atomic():
+            recipe = Recipe.objects.create(
+                tags_mask=tag_masks.mask(tag.bit for tag in tags_list),
+                **validated_data
+            )
+            IngredientsInRecipe.objects.bulk_create(
+                IngredientsInRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
                 )
-            existing_ingredients[ingredient.id] = amount
-
-        for item in tags_list:
-            TagsRecipe.objects.create(
-                tag=item,
-                recipe=recipe
+                for ingredient_id, amount in ingredients.items()
             )
+            TagsRecipe.objects.bulk_create(
+                TagsRecipe(recipe=recipe, tag=tag) for tag in set(tags_list)
+            )
+            search.schedule_update([recipe.pk])
+        self.save_image_variants(recipe)
         return recipe
 
     def update(self, instance, validated_data):
-        if validated_data.get('image') is not None:
-            instance.image = validated_data.pop('image')
-        instance.name = validated_data.get('name')
-        instance.text = validated_data.get('text')
-        instance.cooking_time = validated_data.get('cooking_time')
-
-        tags_list = validated_data.pop('tags')
-        instance.tags.set(tags_list)
-        existing_ingredients = {}
-        ingredient_list = validated_data.pop('ingredients')
-        instance.ingredients.clear()
-        for item in ingredient_list:
-            ingredient = get_object_or_404(Ingredients, id=item.get('id'))
-            amount = item['amount']
-
-            if ingredient.id in existing_ingredients:
-                amount_ex = existing_ingredients[ingredient.id]
-
-                instance.ingredients.remove(ingredient)
-
-                instance.ingredients.add(
-                    ingredient,
-                    through_defaults={'amount': (amount_ex + amount)}
-                )
-
-                existing_ingredients[ingredient.id] = amount + amount_ex
-            else:
-                instance.ingredients.add(
-                    ingredient,
-                    through_defaults={'amount': amount}
+        """
+        Обновляет только изменившиеся поля и связи рецепта.
+
+        Поля, не переданные в PATCH, не затрагиваются; теги и
+        ингредиенты сравниваются с текущими и меняются пакетно.
+        """
+        tags_list = validated_data.pop('tags', None)
+        ingredient_list = validated_data.pop('ingredients', None)
+        image = validated_data.pop('image', None)
+        update_fields = [
+            field for field, value in validated_data.items()
+            if getattr(instance, field) != value
+        ]
+        for field in update_fields:
+            setattr(instance, field, validated_data[field])
+        if image is not None:
+            instance.image = image
+            update_fields.append('image')
+        with transaction.atomic():
+            relations_changed = False
+            if tags_list is not None and self.update_tags(
+                    instance, tags_list):
+                relations_changed = True
+                update_fields.append('tags_mask')
+            if ingredient_list is not None:
+                relations_changed |= self.update_ingredients(
+                    instance, merge_ingredients(ingredient_list)
                 )
-                existing_ingredients[ingredient.id] = amount
-
-        instance.save()
+            # updated меняется одним сохранением на все изменения связей,
+            # у строк связей нет своих сигналов.
+            if update_fields or relations_changed:
+                instance.save(update_fields=update_fields + ['updated'])
+        if image is not None:
+            self.save_image_variants(instance)
         return instance
 
-
-class RecipeSerializer(serializers.ModelSerializer):
+    def save_image_variants(self, recipe):
+        """Строит и сохраняет уменьшенные копии фото рецепта."""
+        save_variants(recipe)
+
+    def update_tags(self, recipe, tags_list):
+        current = {tag.id for tag in recipe.tags.all()}
+        desired = {tag.id for tag in tags_list}
+        if current == desired:
+            return False
+        TagsRecipe.objects.filter(
+            recipe=recipe, tag_id__in=current - desired
+        ).delete()
+        TagsRecipe.objects.bulk_create(
+            TagsRecipe(recipe=recipe, tag_id=tag_id)
+            for tag_id in desired - current
+        )
+        recipe.tags_mask = tag_masks.mask(tag.bit for tag in tags_list)
+        return True
+
+    def update_ingredients(self, recipe, ingredients):
+        current = {
+            item.ingredient_id: item
+            for item in recipe.recipe_ingredients.all()
+        }
+        removed = [
+            item.id for ingredient_id, item in current.items()
+            if ingredient_id not in ingredients
+        ]
+        cart_totals.change_recipe(recipe.id, cart_totals.amounts_delta(
+            {item.ingredient_id: item.amount for item in current.values()},
+            ingredients,
+        ))
+        changed = []
+        added = []
+        for ingredient_id, amount in ingredients.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                added.append(IngredientsInRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+            elif item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if removed:
+            IngredientsInRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientsInRecipe.objects.bulk_update(changed, ('amount',))
+        if added:
+            IngredientsInRecipe.objects.bulk_create(added)
+        if removed or changed or added:
+            search.schedule_update([recipe.pk])
+        return bool(removed or changed or added)
+
+
+class RecipeSerializer(TimedSerializerMixin,
+                       serializers.ModelSerializer):
     """Сериализатор для списка рецептов."""
 
     def __init__(self, *args, **kwargs):
@@ -171,7 +381,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = ShowIngredientsInRecipeSerializer(
         many=True, source='recipe_ingredients'
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
+    images = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -184,22 +395,47 @@ class RecipeSerializer(serializers.ModelSerializer):
             'ingredients',
             'is_favorited',
             'is_in_shopping_cart',
+            'favorites_count',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time'
         )
 
+    def get_images(self, obj):
+        """URL вариантов изображения, нужных текущему представлению."""
+        if not obj.image:
+            return {}
+        request = self.context.get('request')
+        storage = obj.image.storage
+        images = {}
+        for variant in self.context.get(
+                'image_variants', DEFAULT_IMAGE_VARIANTS):
+            if variant == 'original':
+                images[variant] = image_url(storage, obj.image.name, request)
+            elif variant in VARIANTS and variant in obj.image_variants:
+                images[variant] = {
+                    extension: image_url(storage, name, request)
+                    for extension, name in obj.image_variants[variant].items()
+                }
+        return images
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
-        return user.is_authenticated and bool(obj.lover.filter(user=user))
+        return user.is_authenticated and obj.lover.filter(user=user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
-        return user.is_authenticated and bool(obj.buyer.filter(user=user))
+        return user.is_authenticated and obj.buyer.filter(user=user).exists()
 
 
-class FavoriteRecipeSerializer(serializers.ModelSerializer):
+class FavoriteRecipeSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
     """Сериализатор для списка избранного."""
 
     id = serializers.CharField(
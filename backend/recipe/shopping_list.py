@@ -0,0 +1,164 @@
+"""
+Выгрузка списка покупок в TXT, CSV и PDF.
+
+Файл отдаётся потоком. Готовый файл кэшируется для пользователя
+по версии корзины: агрегату списка покупок и дате изменения
+рецептов в нём, так что повторная выгрузка той же корзины
+не пересчитывает ингредиенты и не строит PDF заново.
+"""
+import csv
+import os
+from hashlib import md5
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max
+from django.http import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from foodgram import metrics
+
+from .cache import INGREDIENTS_VERSION_KEY, get_version
+from .models import IngredientsInShoppingList, ShoppingList
+
+TITLE = 'Список покупок'
+FILENAME = 'Shopping_cart'
+CSV_HEADER = ('Ингредиент', 'Количество', 'Единица измерения')
+# Размер частей, которыми отдаётся готовый файл.
+CHUNK_SIZE = 64 * 1024
+
+PDF_FONT = 'ShoppingListFont'
+PDF_FALLBACK_FONT = 'Helvetica'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 20 * mm
+PDF_LEADING = 7 * mm
+
+
+def cart_version(user):
+    """
+    Меняется при любом изменении корзины и рецептов в ней, а также
+    названий и единиц ингредиентов (поколение ингредиентов в кэше).
+    """
+    state = ShoppingList.objects.filter(user=user).aggregate(
+        count=Count('id'), last=Max('id'), updated=Max('recipe__updated')
+    )
+    state['ingredients'] = get_version(INGREDIENTS_VERSION_KEY)
+    return md5(repr(sorted(state.items())).encode()).hexdigest()
+
+
+def get_items(user):
+    """Суммарное количество каждого ингредиента в корзине."""
+    return IngredientsInShoppingList.objects.filter(user=user).values(
+        'amount',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+    ).order_by('name')
+
+
+def render_txt(items):
+    yield f'{TITLE}:\n\n'.encode()
+    separator = ''
+    for item in items:
+        yield (
+            f'{separator}{item["name"]} - '
+            f'{item["amount"]} {item["measurement_unit"]}'
+        ).encode()
+        separator = '\n'
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(items):
+    writer = csv.writer(Echo())
+    # BOM, чтобы Excel распознал UTF-8.
+    yield '\ufeff'.encode()
+    yield writer.writerow(CSV_HEADER).encode()
+    for item in items:
+        yield writer.writerow(
+            (item['name'], item['amount'], item['measurement_unit'])
+        ).encode()
+
+
+def split(content):
+    for start in range(0, len(content), CHUNK_SIZE):
+        yield content[start:start + CHUNK_SIZE]
+
+
+def get_pdf_font():
+    """Шрифт с кириллицей из SHOPPING_LIST_PDF_FONT, если он есть."""
+    if PDF_FONT in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT
+    if not os.path.exists(settings.SHOPPING_LIST_PDF_FONT):
+        return PDF_FALLBACK_FONT
+    pdfmetrics.registerFont(
+        TTFont(PDF_FONT, settings.SHOPPING_LIST_PDF_FONT))
+    return PDF_FONT
+
+
+def render_pdf(items):
+    """PDF собирается целиком в памяти и отдаётся частями."""
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    pdf.setTitle(TITLE)
+    font = get_pdf_font()
+    top = A4[1] - PDF_MARGIN
+    pdf.setFont(font, PDF_FONT_SIZE + 4)
+    pdf.drawString(PDF_MARGIN, top, TITLE)
+    pdf.setFont(font, PDF_FONT_SIZE)
+    y = top - 2 * PDF_LEADING
+    for number, item in enumerate(items, 1):
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(font, PDF_FONT_SIZE)
+            y = top
+        pdf.drawString(
+            PDF_MARGIN, y,
+            f'{number}. {item["name"]} - '
+            f'{item["amount"]} {item["measurement_unit"]}'
+        )
+        y -= PDF_LEADING
+    pdf.save()
+    yield from split(buffer.getvalue())
+
+
+RENDERERS = {
+    'txt': render_txt,
+    'csv': render_csv,
+    'pdf': render_pdf,
+}
+
+
+def caching(chunks, key):
+    """Отдаёт части файла и кладёт его в кэш, когда он отдан целиком."""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(parts), settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def shopping_list_response(user, file_format, content_type):
+    """Потоковый ответ с файлом списка покупок в формате file_format."""
+    key = f'shopping_list:{user.pk}:{cart_version(user)}:{file_format}'
+    content = cache.get(key)
+    metrics.cache_lookup('shopping_list', content is not None)
+    if content is not None:
+        chunks = split(content)
+    else:
+        chunks = caching(
+            RENDERERS[file_format](get_items(user).iterator()), key)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename={FILENAME}.{file_format}'
+    )
+    return response
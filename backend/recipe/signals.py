@@ -0,0 +1,234 @@
+from django.db.models.signals import (m2m_changed,
+                                      post_delete,
+                                      post_save,
+                                      pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import Subscribtion, User
+from . import cache, cart_totals, search, tag_masks
+from .counters import change_counter
+from .deferred import Deferred
+from .models import (FavoriteRecipe,
+                     Ingredients,
+                     IngredientsInRecipe,
+                     Recipe,
+                     ShoppingList,
+                     Tags,
+                     TagsRecipe)
+
+
+def bump_versions(keys, using):
+    for key in keys:
+        cache.bump_version(key)
+
+
+# Каждый ключ сбрасывается один раз за транзакцию, сколько бы строк
+# в ней ни изменилось.
+version_bumps = Deferred(bump_versions)
+
+
+def bump_cache_version():
+    """Сбрасывает кэш рецептов после фиксации транзакции."""
+    version_bumps.add([cache.VERSION_KEY])
+
+
+def bump_ingredients_version():
+    """Перестраивает индексы ингредиентов после фиксации транзакции."""
+    version_bumps.add([cache.INGREDIENTS_VERSION_KEY])
+
+
+def bump_tags_version():
+    """Перестраивает снимок тэгов после фиксации транзакции."""
+    version_bumps.add([cache.TAGS_VERSION_KEY])
+
+
+def touch_recipes(**lookup):
+    """Обновляет колонку updated у рецептов, попавших под lookup."""
+    Recipe.objects.filter(**lookup).update(updated=timezone.now())
+
+
+# Поля рецепта, от которых зависит поисковый индекс. Одно поле updated
+# сохраняется при изменении ингредиентов рецепта.
+SEARCH_FIELDS = {'name', 'text', 'updated'}
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, **kwargs):
+    bump_cache_version()
+
+
+# Пакетная запись из сериализатора и админки сбрасывает кэш сама,
+# эти обработчики - для остальных записей строк связей (shell,
+# миграции данных): сброс всё равно один на транзакцию.
+@receiver(post_save, sender=TagsRecipe)
+@receiver(post_delete, sender=TagsRecipe)
+@receiver(post_save, sender=IngredientsInRecipe)
+@receiver(post_delete, sender=IngredientsInRecipe)
+def recipe_relation_changed(sender, **kwargs):
+    bump_cache_version()
+
+
+@receiver(m2m_changed, sender=TagsRecipe)
+@receiver(m2m_changed, sender=IngredientsInRecipe)
+def recipe_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        field = 'tags' if sender is TagsRecipe else 'ingredients'
+        touch_recipes(**{field: instance})
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        touch_recipes(pk=instance.pk)
+    elif pk_set:
+        touch_recipes(pk__in=pk_set)
+    bump_cache_version()
+
+
+@receiver(m2m_changed, sender=TagsRecipe)
+def recipe_tags_m2m_mask(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """Маска тегов при изменении через recipe.tags и tag.recipes."""
+    if reverse and action == 'pre_clear':
+        if instance.bit is not None:
+            tag_masks.clear_bit(instance.bit)
+    elif action in ('post_add', 'post_remove'):
+        tag_masks.rebuild(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear' and not reverse:
+        tag_masks.rebuild([instance.pk])
+
+
+# Тег, ингредиент или автор входят в ответы о рецептах, но их
+# изменение не трогает recipe.updated: ETag и кэш рецептов зависят
+# от поколения кэша, которое сбрасывается здесь.
+@receiver(post_save, sender=Tags)
+def tag_saved(sender, instance, **kwargs):
+    bump_cache_version()
+    bump_tags_version()
+
+
+@receiver(pre_save, sender=Tags)
+def tag_bit_assigned(sender, instance, **kwargs):
+    if instance.bit is None:
+        instance.bit = tag_masks.take_bit(tag_masks.free_bits())
+
+
+@receiver(pre_delete, sender=Tags)
+def tag_bit_released(sender, instance, **kwargs):
+    if instance.bit is not None:
+        tag_masks.clear_bit(instance.bit)
+
+
+@receiver(post_save, sender=Ingredients)
+def ingredient_saved(sender, instance, **kwargs):
+    bump_cache_version()
+    bump_ingredients_version()
+
+
+@receiver(post_delete, sender=Tags)
+@receiver(post_delete, sender=Ingredients)
+def catalog_item_deleted(sender, **kwargs):
+    bump_cache_version()
+    if sender is Ingredients:
+        bump_ingredients_version()
+    else:
+        bump_tags_version()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    """Вход пользователя обновляет только last_login и кэш не трогает."""
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_cache_version()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        search.schedule_update([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted_search(sender, instance, **kwargs):
+    search.remove_from_index([instance.pk])
+
+
+@receiver(post_save, sender=IngredientsInRecipe)
+@receiver(post_delete, sender=IngredientsInRecipe)
+def recipe_ingredient_changed_search(sender, instance, **kwargs):
+    search.schedule_update([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=IngredientsInRecipe)
+def recipe_ingredients_m2m_search(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    if reverse and action == 'pre_clear':
+        search.schedule_update(
+            instance.recipes.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        search.schedule_update(
+            (pk_set or []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Ingredients)
+def ingredient_saved_search(sender, instance, created, **kwargs):
+    if not created:
+        search.schedule_update(
+            instance.recipes.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Ingredients)
+def ingredient_deleted_search(sender, instance, **kwargs):
+    """Строки связей удаляются каскадом без сигналов."""
+    search.schedule_update(instance.recipes.values_list('pk', flat=True))
+
+
+# Счётчики: модель строки -> (модель со счётчиком, поле связи, счётчик).
+COUNTED_RELATIONS = {
+    FavoriteRecipe: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingList: (Recipe, 'recipe_id', 'shopping_cart_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Subscribtion: (User, 'author_id', 'followers_count'),
+}
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscribtion)
+def counted_relation_created(sender, instance, created, **kwargs):
+    if created:
+        model, field, counter = COUNTED_RELATIONS[sender]
+        change_counter(model, getattr(instance, field), counter, 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscribtion)
+def counted_relation_deleted(sender, instance, **kwargs):
+    model, field, counter = COUNTED_RELATIONS[sender]
+    change_counter(model, getattr(instance, field), counter, -1)
+
+
+@receiver(post_save, sender=ShoppingList)
+def shopping_list_added(sender, instance, created, **kwargs):
+    if created:
+        cart_totals.change_totals(
+            [instance.user_id], cart_totals.recipe_amounts(instance.recipe_id)
+        )
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def shopping_list_removed(sender, instance, **kwargs):
+    """
+    pre_delete: при каскадном удалении рецепта его ингредиенты
+    ещё на месте.
+    """
+    cart_totals.change_totals(
+        [instance.user_id], cart_totals.recipe_amounts(instance.recipe_id),
+        sign=-1,
+    )
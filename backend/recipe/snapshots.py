@@ -0,0 +1,97 @@
+"""
+Готовые ответы для справочников тэгов и ингредиентов.
+
+Полный список без фильтров хранится в памяти процесса уже
+отрендеренным в JSON и сжатым gzip и brotli, с ETag по хешу
+содержимого. Сжатые варианты - разные представления ресурса,
+поэтому их ETag получает суффикс кодирования: "<хеш>-gzip".
+Снимок перестраивается при смене поколения справочника в кэше
+(см. recipe.signals), так что запрос без параметров не обращается
+ни к БД, ни к сериализатору.
+"""
+import gzip
+import threading
+from collections import namedtuple
+from hashlib import md5
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from foodgram import metrics
+
+from . import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+Snapshot = namedtuple('Snapshot', ('version', 'digest', 'encodings'))
+
+_lock = threading.Lock()
+_snapshots = {}
+
+
+def build_snapshot(version, data):
+    """Рендерит data и готовит варианты тела для каждого кодирования."""
+    content = JSONRenderer().render(data)
+    encodings = {}
+    if brotli is not None:
+        encodings['br'] = brotli.compress(content)
+    encodings['gzip'] = gzip.compress(content)
+    encodings['identity'] = content
+    return Snapshot(version, md5(content).hexdigest(), encodings)
+
+
+def get_snapshot(version_key, get_data):
+    """Снимок справочника, перестроенный при смене его поколения."""
+    version = cache.get_version(version_key)
+    snapshot = _snapshots.get(version_key)
+    hit = snapshot is not None and snapshot.version == version
+    metrics.cache_lookup('snapshots', hit)
+    if not hit:
+        with _lock:
+            snapshot = _snapshots.get(version_key)
+            if snapshot is None or snapshot.version != version:
+                snapshot = build_snapshot(version, get_data())
+                _snapshots[version_key] = snapshot
+    return snapshot
+
+
+def accepted_encodings(request):
+    """Кодирования из Accept-Encoding, кроме явно запрещённых (q=0)."""
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        quality = params.strip().partition('=')[2]
+        try:
+            if quality and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def encoding_etag(snapshot, encoding):
+    if encoding == 'identity':
+        return f'"{snapshot.digest}"'
+    return f'"{snapshot.digest}-{encoding}"'
+
+
+def snapshot_response(request, snapshot):
+    """Ответ со снимком в лучшем кодировании, которое примет клиент."""
+    accepted = accepted_encodings(request)
+    for encoding, content in snapshot.encodings.items():
+        if encoding in accepted or encoding == 'identity':
+            break
+    etag = encoding_etag(snapshot, encoding)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/json')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
@@ -0,0 +1,104 @@
+"""
+Теги рецепта битовой маской в Recipe.tags_mask.
+
+Каждому тегу назначается свой бит Tags.bit, маска рецепта - сумма
+битов его тегов. Фильтр по тегам проверяет одно условие
+tags_mask & <маска запроса> без JOIN и DISTINCT, а слаги переводит
+в биты по карте в памяти процесса, которая перестраивается при смене
+поколения тегов в кэше (см. recipe.signals). Маска меняется вместе
+с тегами в RecipeCreateSerializer, при изменении через recipe.tags
+и tag.recipes - в сигналах; после массовой записи связей в обход
+сигналов её пересчитывает rebuild().
+"""
+import threading
+
+from django.db import connection
+from django.db.models import F
+
+from . import cache
+from .models import Recipe, Tags
+
+# Маска - знаковый BigIntegerField, доступны биты 0..62.
+MAX_TAGS = 63
+LIMIT_MESSAGE = f'Тегов не может быть больше {MAX_TAGS}.'
+
+REBUILD_SQL = """
+    UPDATE recipe_recipe SET tags_mask = COALESCE((
+        SELECT SUM(CAST(1 AS BIGINT) << t.bit)
+        FROM recipe_tags AS t
+        WHERE t.id IN (
+            SELECT tr.tag_id FROM recipe_tagsrecipe AS tr
+            WHERE tr.recipe_id = recipe_recipe.id
+        )
+    ), 0)
+"""
+
+_lock = threading.Lock()
+_bits = {}
+_bits_version = None
+
+
+def mask(bits):
+    """Маска набора битов; повторы не учитываются."""
+    return sum(1 << bit for bit in set(bits))
+
+
+def free_bits(model=Tags):
+    used = set(model.objects.exclude(bit=None).values_list('bit', flat=True))
+    return (bit for bit in range(MAX_TAGS) if bit not in used)
+
+
+def take_bit(free):
+    bit = next(free, None)
+    if bit is None:
+        raise ValueError(LIMIT_MESSAGE)
+    return bit
+
+
+def assign_bits(model=Tags):
+    """Назначает свободные биты тегам без бита, например после bulk_create."""
+    free = free_bits(model)
+    for pk in list(model.objects.filter(bit=None).order_by('id').values_list(
+            'pk', flat=True)):
+        model.objects.filter(pk=pk).update(bit=take_bit(free))
+
+
+def clear_bit(bit):
+    """Убирает бит удаляемого тега из масок, чтобы его можно было занять."""
+    Recipe.objects.alias(
+        has_tag=F('tags_mask').bitand(1 << bit)
+    ).filter(has_tag__gt=0).update(tags_mask=F('tags_mask') - (1 << bit))
+
+
+def rebuild(recipe_ids=None, using=connection):
+    """Пересчитывает маски рецептов (по умолчанию всех) по связям с тегами."""
+    sql, params = REBUILD_SQL, []
+    if recipe_ids is not None:
+        params = list(recipe_ids)
+        if not params:
+            return
+        sql += f' WHERE id IN ({", ".join(["%s"] * len(params))})'
+    with using.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def get_bits():
+    """{слаг: бит} текущего процесса."""
+    global _bits, _bits_version
+    version = cache.get_version(cache.TAGS_VERSION_KEY)
+    if version != _bits_version:
+        with _lock:
+            if version != _bits_version:
+                _bits = dict(Tags.objects.exclude(bit=None).values_list(
+                    'slug', 'bit'))
+                _bits_version = version
+    return _bits
+
+
+def filter_by_slugs(queryset, slugs):
+    """Рецепты хотя бы с одним из тегов slugs."""
+    bits = get_bits()
+    slugs_mask = mask(bits[slug] for slug in slugs if slug in bits)
+    return queryset.alias(
+        tags_match=F('tags_mask').bitand(slugs_mask)
+    ).filter(tags_match__gt=0)
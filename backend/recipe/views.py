@@ -1,29 +1,42 @@
 from rest_framework import viewsets, status, permissions
 from django_filters.rest_framework import DjangoFilterBackend
+from .autocomplete import get_index
 from .filters import RecipeFilter, IngredientFilter
+from .cache import (COUNTERS, INGREDIENTS_VERSION_KEY, TAGS_VERSION_KEY,
+                    USER_FLAGS, VERSION_KEY, get_recipes, get_version)
+from .mixins import (CachedResponseMixin,
+                     ConditionalGetMixin,
+                     SnapshotListMixin)
+from .parsers import BoundedJSONParser
+from .renderers import SHOPPING_LIST_RENDERERS
+from .shopping_list import shopping_list_response
 from .models import (Recipe,
                      Tags,
                      Ingredients,
                      ShoppingList,
                      FavoriteRecipe,
-                     IngredientsInRecipe)
+                     IngredientsInRecipe,
+                     IngredientsInShoppingList)
 from .serializers import (RecipeSerializer,
                           TagsSerializer,
                           IngredientsSerializer,
                           RecipeCreateSerializer,
                           FavoriteRecipeSerializer,
                           FavoriteCreateSerializer,
-                          ShoppingCreateSerializer
+                          ShoppingCreateSerializer,
+                          ShoppingListIngredientsSerializer
                           )
 from .permissions import (IsAuthorOrAdmin,
                           IsAdminOrReadOnly,
                           IsAuthorOrAdminOnlyPermission)
-from users.pagination import LimitPageNumerPagination
+from foodgram.timing import TimedViewMixin
+from users.models import Subscribtion
+from users.pagination import LimitPagination
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework import serializers
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.db.models import Exists, OuterRef, Prefetch, Value
 
 
 def custom_post_delete(self, request, pk, func_model):
@@ -53,15 +66,60 @@ def custom_post_delete(self, request, pk, func_model):
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(TimedViewMixin,
+                    ConditionalGetMixin,
+                    CachedResponseMixin,
+                    viewsets.ModelViewSet):
     """Viewset для рецептов."""
 
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthorOrAdmin,)
-    pagination_class = LimitPageNumerPagination
+    pagination_class = LimitPagination
+    parser_classes = (BoundedJSONParser, MultiPartParser, FormParser)
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    conditional_version_keys = (VERSION_KEY,)
+
+    def get_queryset(self):
+        """
+        Загружает автора, теги и ингредиенты заранее, а флаги
+        is_favorited / is_in_shopping_cart вычисляет подзапросами,
+        чтобы число запросов не зависело от размера страницы.
+        """
+        return self.annotate_user_flags(
+            Recipe.objects.select_related('author').prefetch_related(
+                'tags',
+                Prefetch(
+                    'recipe_ingredients',
+                    queryset=IngredientsInRecipe.objects.select_related(
+                        'ingredient'
+                    )
+                ),
+            )
+        )
+
+    def annotate_user_flags(self, queryset):
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                recipe=OuterRef('pk'), user=user
+            )),
+            is_in_shopping_cart=Exists(ShoppingList.objects.filter(
+                recipe=OuterRef('pk'), user=user
+            )),
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['image_variants'] = ('card',)
+        return context
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
@@ -83,6 +141,48 @@ class RecipeViewSet(viewsets.ModelViewSet):
             self.permission_classes = (IsAuthorOrAdminOnlyPermission,)
         return super().get_permissions()
 
+    def get_conditional_validators(self):
+        """
+        Для retrieve - одним запросом: updated, счётчики и флаги
+        пользователя рецепта вместе с поколением кэша, до построения
+        ответа. ETag списка строится по отданным рецептам, см.
+        get_served_state.
+        """
+        if self.action != 'retrieve':
+            return None, None
+        user = self.request.user
+        subscribed = Value(False)
+        if user.is_authenticated:
+            subscribed = Exists(Subscribtion.objects.filter(
+                user=user, author=OuterRef('author')
+            ))
+        try:
+            row = self.annotate_user_flags(
+                Recipe.objects.filter(pk=self.kwargs['pk'])
+            ).annotate(is_subscribed=subscribed).values_list(
+                'updated', *COUNTERS, *USER_FLAGS, 'is_subscribed'
+            ).first()
+        except (TypeError, ValueError):
+            return None, None
+        if row is None:
+            return None, None
+        versions = [get_version(key) for key in self.conditional_version_keys]
+        return (versions, row), row[0]
+
+    def get_served_state(self, data):
+        """
+        id, счётчики и флаги пользователя отданных рецептов; остальное
+        содержимое меняется только вместе с поколением кэша рецептов.
+        """
+        return [
+            (
+                recipe['id'],
+                *(recipe[field] for field in COUNTERS + USER_FLAGS),
+                recipe['author']['is_subscribed'],
+            )
+            for recipe in get_recipes(data)
+        ]
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -104,43 +204,67 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=False,
         permission_classes=[permissions.IsAuthenticated],
         methods=['GET'],
+        url_path='shopping_cart/totals',
+        url_name='shopping-cart-totals',
+    )
+    def shopping_cart_totals(self, request):
+        """Суммы ингредиентов в списке покупок, по ингредиентам."""
+        totals = IngredientsInShoppingList.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by('ingredient__name')
+        return Response(
+            ShoppingListIngredientsSerializer(totals, many=True).data
+        )
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+        methods=['GET'],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = IngredientsInRecipe.objects.filter(
-            recipe__buyer__user=user).values(
-            name=F('ingredient__name'),
-            measurement_unit=F('ingredient__measurement_unit')).annotate(
-            amount=Sum('amount')
+        """Список покупок в формате ?format=txt|csv|pdf (по умолчанию txt)."""
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        return shopping_list_response(
+            request.user, renderer.format, content_type
         )
-        data = []
-        for ingredient in ingredients:
-            data.append(
-                f'{ingredient["name"]} - '
-                f'{ingredient["amount"]} '
-                f'{ingredient["measurement_unit"]}'
-            )
-        content = 'Список покупок:\n\n' + '\n'.join(data)
-        filename = 'Shopping_cart.txt'
-        request = HttpResponse(content, content_type='text/plain')
-        request['Content-Disposition'] = f'attachment; filename={filename}'
-        return request
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class TagsViewSet(TimedViewMixin, SnapshotListMixin, ConditionalGetMixin,
+                  viewsets.ReadOnlyModelViewSet):
     """ViewSet для обработки тэгов."""
 
     queryset = Tags.objects.all()
     serializer_class = TagsSerializer
     pagination_class = None
+    snapshot_version_key = TAGS_VERSION_KEY
     permission_classes = (IsAdminOrReadOnly,)
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(TimedViewMixin, SnapshotListMixin,
+                         ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet для обработки ингредиентов."""
 
     queryset = Ingredients.objects.all()
     serializer_class = IngredientsSerializer
     pagination_class = None
+    snapshot_version_key = INGREDIENTS_VERSION_KEY
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+
+    def list(self, request, *args, **kwargs):
+        """
+        Поиск по name обслуживается индексом в памяти без запросов к БД:
+        сначала совпадения по началу слова, затем с опечатками.
+        """
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            limit = serializers.IntegerField(min_value=1).run_validation(
+                limit)
+        return Response(get_index().search(name, limit))
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.19 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+from recipe.counters import reconcile
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    reconcile(User, 'recipes_count',
+              apps.get_model('recipe', 'Recipe'), 'author')
+    reconcile(User, 'followers_count',
+              apps.get_model('users', 'Subscribtion'), 'author')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('recipe', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -33,6 +33,12 @@ class User(AbstractUser):
     last_name = models.CharField(max_length=150,
                                  blank=False,
                                  verbose_name='Фамилия')
+    recipes_count = models.PositiveIntegerField(default=0,
+                                                editable=False,
+                                                verbose_name='Рецептов')
+    followers_count = models.PositiveIntegerField(default=0,
+                                                  editable=False,
+                                                  verbose_name='Подписчиков')
 
     @property
     def is_moderator(self):
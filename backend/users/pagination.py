@@ -1,7 +1,167 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination,
+                                       Cursor,
+                                       CursorPagination,
+                                       PageNumberPagination)
 
 
 class LimitPageNumerPagination(PageNumberPagination):
     """Кастомизированный класс пагинации."""
 
     page_size_query_param = 'limit'
+
+
+class LimitCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация по ключу (pub_date, id) без подсчёта числа
+    записей.
+
+    Курсор хранит значения всех полей порядка у крайней записи
+    страницы, следующая страница - записи строго после неё:
+    pub_date < p OR (pub_date = p AND id < i), предыдущая - то же
+    в обратную сторону. В отличие от позиции и смещения
+    CursorPagination, страницы сходятся при любом числе записей
+    с одной pub_date, и запрос обслуживается индексом (-pub_date, -id).
+
+    Порядок можно переопределить атрибутом cursor_ordering у view;
+    последнее поле должно быть уникальным.
+    """
+
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(
+                order[1:] if order.startswith('-') else f'-{order}'
+                for order in ordering
+            )
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None and self.cursor.position is not None:
+            try:
+                queryset = queryset.filter(
+                    self.after(self.cursor.position, ordering))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def after(self, position, ordering):
+        """Условие "строго после position" в порядке ordering."""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        conditions = []
+        equal = {}
+        for order, value in zip(ordering, values):
+            field = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') else 'gt'
+            conditions.append(Q(**equal, **{f'{field}__{lookup}': value}))
+            equal[field] = value
+        return reduce(operator.or_, conditions)
+
+    def get_position(self, instance):
+        return json.dumps([
+            str(getattr(instance, order.lstrip('-')))
+            for order in self.ordering
+        ])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = (
+            self.get_position(self.page[-1]) if self.page
+            else self.cursor.position
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = (
+            self.get_position(self.page[0]) if self.page
+            else self.cursor.position
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position))
+
+
+class LimitPagination(BasePagination):
+    """
+    Постраничная пагинация с курсорным режимом по запросу.
+
+    Курсорный режим включается параметром ?pagination=cursor
+    (ссылки next/previous сохраняют его) или наличием ?cursor=.
+    """
+
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+
+    def __init__(self):
+        self.page_number_paginator = LimitPageNumerPagination()
+        self.cursor_paginator = LimitCursorPagination()
+        self.paginator = self.page_number_paginator
+
+    def is_cursor_mode(self, request):
+        return (
+            request.query_params.get(self.mode_query_param)
+            == self.cursor_mode
+            or self.cursor_paginator.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_cursor_mode(request):
+            self.paginator = self.cursor_paginator
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number_paginator.get_paginated_response_schema(
+            schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_schema_operation_parameters(self, view):
+        parameters = {}
+        for paginator in (self.page_number_paginator, self.cursor_paginator):
+            for parameter in paginator.get_schema_operation_parameters(view):
+                parameters.setdefault(parameter['name'], parameter)
+        return list(parameters.values())
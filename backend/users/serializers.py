@@ -1,8 +1,16 @@
+from collections import defaultdict
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
 from .models import User, Subscribtion
+from .subscriptions import IsSubscribedField
 from djoser.serializers import UserCreateSerializer
 from rest_framework import serializers, validators
 from recipe.models import Recipe
+from recipe.serializers import RecipeImageField
 from rest_framework.validators import UniqueTogetherValidator
+from foodgram.timing import TimedSerializerMixin
 
 
 class UserRegistrationSerializer(UserCreateSerializer):
@@ -18,7 +26,8 @@ class UserRegistrationSerializer(UserCreateSerializer):
                   'password']
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class CustomUserSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор для пользователя."""
 
     username = serializers.CharField(
@@ -27,7 +36,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
             queryset=User.objects.all()
         )]
     )
-    is_subscribed = serializers.SerializerMethodField(read_only=True)
+    is_subscribed = IsSubscribedField()
 
     class Meta:
         model = User
@@ -38,21 +47,62 @@ class CustomUserSerializer(serializers.ModelSerializer):
                   'last_name',
                   'is_subscribed']
 
-    def get_is_subscribed(self, obj):
-        """Проверка подписки пользователя на автора."""
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return Subscribtion.objects.filter(user=self.context['request'].user,
-                                           author=obj).exists()
 
+def get_recipes_limit(request):
+    """Значение recipes_limit из запроса; без него - None, все рецепты."""
+    value = request.query_params.get('recipes_limit') if request else None
+    if not value:
+        return None
+    return serializers.IntegerField(min_value=0).run_validation(value)
 
-class SubscribtionSerializer(serializers.ModelSerializer):
+
+def rank_recipes(authors):
+    """Рецепты авторов, пронумерованные от новых к старым в recipe_rank."""
+    return Recipe.objects.filter(author__in=authors).annotate(
+        recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=[F('pub_date').desc(), F('id').desc()],
+        )
+    ).only(
+        'id', 'author_id', 'name', 'image', 'image_variants',
+        'cooking_time', 'pub_date'
+    ).order_by()
+
+
+def attach_latest_recipes(authors, limit=None):
+    """
+    Загружает по limit (None - все) последних рецептов каждого автора
+    одним запросом.
+
+    Рецепты нумеруются ROW_NUMBER() в разрезе автора и отбираются
+    по номеру, результат кладётся в author.latest_recipes.
+    """
+    authors = list(authors)
+    if not authors:
+        return authors
+    sql, params = rank_recipes(authors).query.sql_with_params()
+    where = ''
+    if limit is not None:
+        where = 'WHERE recipe_rank <= %s '
+        params = (*params, limit)
+    recipes = defaultdict(list)
+    for recipe in Recipe.objects.raw(
+        f'SELECT * FROM ({sql}) ranked {where}ORDER BY recipe_rank', params
+    ):
+        recipes[recipe.author_id].append(recipe)
+    for author in authors:
+        author.latest_recipes = recipes[author.pk]
+    return authors
+
+
+class SubscribtionSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     """Сериализатор для подписок."""
 
-    is_subscribed = serializers.SerializerMethodField(read_only=True)
+    is_subscribed = IsSubscribedField()
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -65,24 +115,15 @@ class SubscribtionSerializer(serializers.ModelSerializer):
                   'recipes',
                   'recipes_count']
 
-    def get_is_subscribed(self, obj):
-        """Проверка подписки на автора."""
-        user = self.context.get('request').user
-        if not user:
-            return False
-        return Subscribtion.objects.filter(user=user, author=obj).exists()
-
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('request').GET.get('recipes_limit')
-        recipes = (
-            obj.recipes.all()[:int(recipes_limit)]
-            if recipes_limit else obj.recipes
-        )
+        """Последние рецепты, см. attach_latest_recipes."""
+        recipes = getattr(obj, 'latest_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.order_by('-pub_date', '-id')[
+                :get_recipes_limit(self.context.get('request'))
+            ]
         return FavoriteShoppingSerializer(recipes, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class FavoriteShoppingSerializer(serializers.ModelSerializer):
     """
@@ -90,6 +131,8 @@ class FavoriteShoppingSerializer(serializers.ModelSerializer):
     избранного и списке покупок.
     """
 
+    image = RecipeImageField(variant='card')
+
     class Meta:
         model = Recipe
         fields = (
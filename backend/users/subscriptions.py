@@ -0,0 +1,36 @@
+"""Подписки пользователя запроса, общие для всех сериализаторов."""
+from rest_framework import serializers
+
+from .models import Subscribtion
+
+
+def subscribed_author_ids(request):
+    """
+    id авторов, на которых подписан пользователь запроса.
+
+    Загружаются одним запросом и запоминаются в request, поэтому
+    is_subscribed для любого числа пользователей в ответе не
+    добавляет запросов.
+    """
+    if request is None or not request.user.is_authenticated:
+        return frozenset()
+    ids = getattr(request, '_subscribed_author_ids', None)
+    if ids is None:
+        ids = request._subscribed_author_ids = set(
+            Subscribtion.objects.filter(
+                user=request.user
+            ).values_list('author_id', flat=True)
+        )
+    return ids
+
+
+class IsSubscribedField(serializers.Field):
+    """Подписан ли пользователь запроса на сериализуемого пользователя."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return value.pk in subscribed_author_ids(self.context.get('request'))
@@ -2,31 +2,41 @@ from rest_framework.response import Response
 from rest_framework import status, serializers
 from .serializers import (SubscribtionSerializer,
                           CustomUserSerializer,
-                          SubscriptionCreateSerializer)
-from .pagination import LimitPageNumerPagination
+                          SubscriptionCreateSerializer,
+                          attach_latest_recipes,
+                          get_recipes_limit)
+from .pagination import LimitPagination
 from djoser.views import UserViewSet
 from rest_framework.decorators import action
 from .models import User
+from foodgram.timing import TimedViewMixin
 
 
-class UserViewSet(UserViewSet):
+class UserViewSet(TimedViewMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
 
-    pagination_class = LimitPageNumerPagination
+    pagination_class = LimitPagination
+    cursor_ordering = ('-id',)
 
     @action(
         methods=['get'], detail=False,
         serializer_class=SubscribtionSerializer
     )
     def subscriptions(self, request):
-        user = self.request.user
-
-        def queryset():
-            return User.objects.filter(following__user=user)
-
-        self.get_queryset = queryset
-        return self.list(request)
+        """Авторы на странице получают рецепты одним запросом."""
+        limit = get_recipes_limit(request)
+        queryset = User.objects.filter(
+            following__user=request.user
+        ).order_by('-id')
+        page = self.paginate_queryset(queryset)
+        authors = attach_latest_recipes(
+            queryset if page is None else page, limit
+        )
+        serializer = self.get_serializer(authors, many=True)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     @action(
         methods=['post', 'delete'], detail=True,